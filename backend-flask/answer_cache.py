@@ -0,0 +1,105 @@
+"""
+Semantic reply cache for the chatbot.
+
+Near-identical first-turn questions ("symptoms of mastitis?", "mastitis
+symptoms") in the same language get the stored answer instead of a new
+Gemini call. Questions are compared by cosine similarity of their rag.py
+embeddings; without sentence-transformers only exact (normalised) repeats hit.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+
+
+def normalise(question):
+    """Case/whitespace/trailing-punctuation insensitive form; rag.py keys its query embeddings on it too"""
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip("?.!। ")
+
+
+class SemanticAnswerCache:
+    def __init__(self, embed=None, threshold=THRESHOLD, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.embed = embed              # callable(list[str]) -> normalised matrix or None
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (language, normalised question) -> (embedding, answer, created)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, text):
+        if self.embed is None or np is None:
+            return None
+        try:
+            embs = self.embed([text])
+            return None if embs is None else embs[0]
+        except Exception:
+            return None
+
+    def lookup(self, language, question):
+        """Cached answer for a similar question in `language`, or None"""
+        key = (language, normalise(question))
+        now = time.time()
+        with self._lock:
+            for k in [k for k, v in self._entries.items() if now - v[2] > self.ttl]:
+                del self._entries[k]
+
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+
+            candidates = [(k, v) for k, v in self._entries.items() if k[0] == language and v[0] is not None]
+
+        query = self._embed(key[1]) if candidates else None
+        if query is not None:
+            matrix = np.vstack([v[0] for _, v in candidates])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                best_key, (_, answer, _) = candidates[best]
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self.hits += 1
+                return answer
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, language, question, answer):
+        key = (language, normalise(question))
+        embedding = self._embed(key[1])
+        with self._lock:
+            self._entries[key] = (embedding, answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl": self.ttl
+        }
@@ -2,11 +2,12 @@ from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from datetime import timedelta
+from dotenv import load_dotenv
+load_dotenv()  # before route imports: they read env config at import time
 from models import db
+from migrations import run_migrations
 from routes.auth_routes import auth_bp
 from routes.data_routes import data_bp
-from dotenv import load_dotenv
-load_dotenv()
 from routes.chatbot_routes import chatbot_bp
 
 
@@ -46,9 +47,10 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 # ✅ Initialize extensions
 db.init_app(app)
 
-# ✅ Create tables if not exist
+# ✅ Create tables if not exist, then apply pending schema migrations (indexes etc.)
 with app.app_context():
     db.create_all()
+    run_migrations()
 
 # ✅ Register Blueprints
 app.register_blueprint(auth_bp, url_prefix="/auth")
@@ -62,4 +64,6 @@ def home():
 if __name__ == "__main__":
     # Bind to 0.0.0.0 so physical devices on the LAN can reach the dev server.
     # Development only — be careful exposing this on untrusted networks.
+    import rag
+    rag.warmup()   # load the RAG index + model now, not on the first chat message
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
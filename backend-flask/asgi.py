@@ -0,0 +1,212 @@
+"""
+ASGI entry point with a natively async chatbot pipeline.
+
+POST /chat/chatbot is served here without tying up a thread for the whole
+Gemini call: prompt building (session history + RAG retrieval) runs in a
+small thread pool, generation is awaited with generate_content_async under a
+concurrency limit, and TTS is queued on the voice_jobs pool as before.
+Every other route goes to the regular Flask app through WsgiToAsgi.
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker --workers 2 --timeout 120
+
+Request and response bodies are identical to the WSGI /chat/chatbot route
+(JSON, multipart/form-data or a raw image/* body, see uploads.py).
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app as flask_app
+import gemini_client
+import rag
+import uploads
+from routes import chatbot_routes as chat_routes
+
+# Max Gemini calls in flight per process; extra requests wait their turn
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+# Max concurrent prompt builds (CPU-bound RAG encoding) per process
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "4"))
+# Defaults to the largest body uploads.read_request() accepts (base64 JSON);
+# the per-format media limit is applied when the body is parsed
+MAX_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", str(uploads.MAX_REQUEST_BYTES)))
+
+
+# asgiref runs every WSGI call on one shared thread by default, which would
+# serialise all the non-chat routes; re-wrap its (undecorated) run_wsgi_app so
+# each request gets its own pool thread. That is an asgiref internal, hence the
+# pinned version in requirements.txt; if it ever moves, fall back to the stock
+# (serialised) adapter instead of failing at import.
+_run_wsgi_app = getattr(WsgiToAsgiInstance.__dict__.get("run_wsgi_app"), "func", None)
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    if _run_wsgi_app is not None:
+        run_wsgi_app = sync_to_async(_run_wsgi_app, thread_sensitive=False)
+
+
+class _ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+if _run_wsgi_app is None:
+    print("⚠️ asgiref internals changed: non-chat routes will run on one shared thread")
+_wsgi_app = _ThreadedWsgiToAsgi(flask_app)
+_generate_slots = None
+_prepare_slots = None
+_in_flight = 0
+
+
+def _semaphores():
+    # Created inside the running loop (Python 3.9 binds semaphores to a loop)
+    global _generate_slots, _prepare_slots
+    if _generate_slots is None:
+        _generate_slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+        _prepare_slots = asyncio.Semaphore(RAG_MAX_CONCURRENCY)
+    return _generate_slots, _prepare_slots
+
+
+async def _spool_body(receive):
+    """The request body in a rewound SpooledTemporaryFile (uploads spill to disk)"""
+    body = tempfile.SpooledTemporaryFile(max_size=uploads.UPLOAD_SPOOL_BYTES)
+    size = 0
+    more = True
+    while more:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            body.close()
+            raise uploads.UploadTooLarge("Request body too large")
+        body.write(chunk)
+        more = message.get("more_body", False)
+    body.seek(0)
+    return body
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _base_url(scope):
+    headers = dict(scope.get("headers") or [])
+    host = headers.get(b"host", b"localhost").decode("latin-1")
+    return f"{scope.get('scheme', 'http')}://{host}"
+
+
+def _in_request_context(base_url, func, *args):
+    """Run a chatbot_routes helper with a Flask request context (for jsonify/host_url)"""
+    with flask_app.test_request_context("/chat/chatbot", method="POST", base_url=base_url):
+        return func(*args)
+
+
+def _prepare_in_context(scope, body):
+    """
+    Parse the spooled body (JSON, multipart or raw image) exactly as the WSGI
+    route does and build the prompt
+    """
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers") or []]
+    with flask_app.test_request_context("/chat/chatbot", method="POST", base_url=_base_url(scope),
+                                        headers=headers, input_stream=body,
+                                        query_string=scope.get("query_string", b"").decode("latin-1")):
+        chat, early = chat_routes._prepare_chat_request()
+        if early is not None:
+            # Early answer (validation / safety): materialise it while the context is live
+            response = flask_app.make_response(early)
+            return None, (response.status_code, response.get_json())
+        return chat, None
+
+
+async def _chatbot_reply(scope, receive, send):
+    global _in_flight
+    generate_slots, prepare_slots = _semaphores()
+    base_url = _base_url(scope)
+    _in_flight += 1
+    body = None
+    try:
+        try:
+            body = await _spool_body(receive)
+        except uploads.UploadTooLarge as e:
+            return await _send_json(send, 413, {"error": str(e), "reply": "That photo is too large. Please send a smaller one."})
+
+        async with prepare_slots:
+            chat, early = await asyncio.to_thread(_prepare_in_context, scope, body)
+        if early:
+            status, payload = early
+            return await _send_json(send, status, payload)
+
+        if chat["cached_reply"]:
+            bot_text = chat["cached_reply"]
+        else:
+            # First call may run model discovery (network) - keep it off the loop
+            model = await asyncio.to_thread(gemini_client.get_model)
+            try:
+                async with generate_slots:
+                    response = await model.generate_content_async(
+                        chat["contents"],
+                        generation_config=chat_routes.GENERATION_CONFIG,
+                        safety_settings=chat_routes.SAFETY_SETTINGS
+                    )
+                bot_text, from_model = chat_routes._reply_from_response(response)
+                if from_model:
+                    await asyncio.to_thread(chat_routes._cache_reply, chat, bot_text)
+            except Exception as gen_error:
+                # Handle generation errors gracefully
+                bot_text = chat_routes._reply_for_error(gen_error)
+
+        payload = await asyncio.to_thread(
+            _in_request_context, base_url, chat_routes._finish_reply, chat, bot_text
+        )
+        await _send_json(send, 200, payload)
+
+    except Exception as e:
+        payload, status = chat_routes._error_reply(e)
+        await _send_json(send, status, payload)
+    finally:
+        _in_flight -= 1
+        if body is not None:
+            body.close()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # No-op when gunicorn's post_fork hook already warmed this worker
+            await asyncio.to_thread(rag.warmup)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def stats():
+    return {
+        "in_flight": _in_flight,
+        "max_concurrency": CHAT_MAX_CONCURRENCY,
+        "rag_max_concurrency": RAG_MAX_CONCURRENCY
+    }
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/chat/chatbot" and scope["method"] == "POST":
+        return await _chatbot_reply(scope, receive, send)
+    if scope["type"] == "http" and scope["path"] == "/chat/async/stats" and scope["method"] == "GET":
+        return await _send_json(send, 200, stats())
+    return await _wsgi_app(scope, receive, send)
@@ -0,0 +1,218 @@
+"""
+Per-query RAG retrieval latency.
+
+    python bench_rag.py                      # 200 queries against the shared index
+    python bench_rag.py --reload-each 5      # also time the old load-per-query path
+    python bench_rag.py --batch 500 --passages 50000
+                                             # retrieve_many / NumPy top-k vs per-query sklearn
+    python bench_rag.py --compare-backends   # dense vs bm25 vs hybrid latency
+    python bench_rag.py --ann --passages 200000
+                                             # IVF recall@k / latency per probe count vs exact
+
+RAG_BACKEND picks the backend for the main run.
+
+Reports the one-off load cost, then p50/p95/mean latency of rag.retrieve()
+with the query embedding computed and served from the query LRU. --batch
+times scoring alone (query embeddings given) on the real index or on a
+synthetic one of --passages random rows, then retrieve_many() end to end.
+--ann builds the IVF index (RAG_ANN_DTYPE, RAG_ANN_LISTS) over the real
+embeddings or --passages clustered synthetic rows and reports recall@k and
+latency of RAGIndex.search() for each probe count against exact top-k.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+import rag
+
+try:
+    from sklearn.neighbors import NearestNeighbors
+except Exception:
+    NearestNeighbors = None
+
+QUERIES = [
+    "How do I treat mastitis in a cow?",
+    "What should buffaloes eat in summer?",
+    "How can I increase milk fat?",
+    "When do calves need vaccination?",
+    "How do I keep the milking area clean?",
+    "Why is my cow giving less milk?",
+]
+
+
+def _summary(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    print(f"{label:<24} n={len(samples):<5} p50={statistics.median(samples) * 1000:8.2f} ms  "
+          f"p95={p95 * 1000:8.2f} ms  mean={statistics.mean(samples) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rag.retrieve()")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--reload-each", type=int, default=0,
+                        help="also time N queries that reload the index first (pre-singleton behaviour)")
+    parser.add_argument("--batch", type=int, default=0, help="queries per batch for the scoring benchmark")
+    parser.add_argument("--passages", type=int, default=0, help="score against N random passages instead of the index")
+    parser.add_argument("--compare-backends", action="store_true", help="time every available backend")
+    parser.add_argument("--ann", action="store_true", help="recall vs latency of the IVF index per probe count")
+    parser.add_argument("--probes", default="1,2,4,8,16,32", help="probe counts for --ann")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if not rag.warmup():
+        rag.ensure_index()
+    print(f"load + warmup ({rag.index.backend}): {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{len(rag.index.docs)} passages")
+
+    _summary(f"retrieve ({rag.index.backend})", _time_queries(rag.index, args.queries, args.k))
+
+    if rag.index.uses_dense:
+        samples = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            rag.retrieve(QUERIES[i % len(QUERIES)], k=args.k)
+            samples.append(time.perf_counter() - start)
+        _summary("retrieve (cached query)", samples)
+
+    if args.compare_backends:
+        for backend in rag.BACKENDS:
+            if backend != "bm25" and not rag.dense_available():
+                continue
+            other = rag.RAGIndex(backend)
+            other.model = rag.index.model   # don't time a second model load
+            other.load()
+            _summary(f"retrieve ({backend})", _time_queries(other, args.queries, args.k))
+
+    if args.reload_each:
+        samples = []
+        for i in range(args.reload_each):
+            start = time.perf_counter()
+            fresh = rag.RAGIndex()
+            fresh.load()
+            fresh.retrieve(QUERIES[i % len(QUERIES)], k=args.k)
+            samples.append(time.perf_counter() - start)
+        _summary("retrieve (reload each)", samples)
+
+    if args.batch:
+        if rag.index.uses_dense:
+            bench_batch(args.batch, args.k, args.passages)
+        else:
+            print("--batch scores embeddings and needs the dense backend")
+
+    if args.ann:
+        if rag.ann is None:
+            print("--ann needs numpy")
+        elif not args.passages and not rag.index.uses_dense:
+            print("--ann without --passages needs the dense backend")
+        else:
+            bench_ann(args.queries, args.k, args.passages, [int(p) for p in args.probes.split(",")])
+    return 0
+
+
+def _time_queries(index, n, k):
+    """Latency of n retrievals with the query embedding cache cleared each time"""
+    samples = []
+    for i in range(n):
+        index.query_cache.clear()
+        start = time.perf_counter()
+        index.retrieve(QUERIES[i % len(QUERIES)], k=k)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_batch(n_queries, k, n_passages):
+    index = rag.index
+    rng = np.random.default_rng(0)
+    if n_passages:
+        scored = rag.RAGIndex()
+        scored.embeddings = rag._unit_rows(rng.standard_normal((n_passages, index.embeddings.shape[1])))
+    else:
+        scored = index
+    query_embs = rag._unit_rows(rng.standard_normal((n_queries, scored.embeddings.shape[1])))
+    print(f"\nscoring {n_queries} queries against {scored.embeddings.shape[0]} passages, k={k}")
+
+    (np_idx, _), elapsed = _timed(lambda: scored.top_k(query_embs, k))
+    print(f"numpy matmul + argpartition: {elapsed * 1000:9.2f} ms total  {elapsed / n_queries * 1e6:9.1f} us/query")
+
+    if NearestNeighbors is not None:
+        nn = NearestNeighbors(n_neighbors=k, metric='cosine').fit(scored.embeddings)
+        sk_idx, elapsed = _timed(lambda: [nn.kneighbors(q[None, :], n_neighbors=k)[1][0] for q in query_embs])
+        print(f"sklearn kneighbors per query: {elapsed * 1000:8.2f} ms total  {elapsed / n_queries * 1e6:9.1f} us/query")
+        same = sum(set(a) == set(b) for a, b in zip(np_idx, sk_idx))
+        print(f"identical top-{k} sets: {same}/{n_queries}")
+    else:
+        print("sklearn not installed, skipping the NearestNeighbors baseline")
+
+    queries = [f"{QUERIES[i % len(QUERIES)]} #{i}" for i in range(n_queries)]
+    index.query_cache.clear()
+    _, elapsed = _timed(lambda: [rag.retrieve_passages(q, k) for q in queries])
+    print(f"retrieve_passages x{n_queries}:   {elapsed * 1000:9.2f} ms total  (one encode per query)")
+    index.query_cache.clear()
+    _, elapsed = _timed(lambda: rag.retrieve_many(queries, k))
+    print(f"retrieve_many({n_queries}):      {elapsed * 1000:9.2f} ms total  (one batched encode)")
+
+
+def _clustered(rng, n, dim, n_topics):
+    """Unit rows scattered around n_topics directions, closer to real embeddings than pure noise"""
+    topics = rag._unit_rows(rng.standard_normal((n_topics, dim)))
+    rows = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 8192):
+        size = min(8192, n - start)
+        block = topics[rng.integers(0, n_topics, size)] + 0.08 * rng.standard_normal((size, dim))
+        rows[start:start + size] = rag._unit_rows(block)
+    return rows
+
+
+def bench_ann(n_queries, k, n_passages, probe_counts):
+    rng = np.random.default_rng(0)
+    scored = rag.RAGIndex()
+    if n_passages:
+        dim = rag.index.embeddings.shape[1] if rag.index.embeddings is not None else 384
+        scored.embeddings = _clustered(rng, n_passages, dim, max(1, n_passages // 500))
+    else:
+        scored.embeddings = rag.index.embeddings
+    n = scored.embeddings.shape[0]
+    # Queries near stored passages, like a question paraphrasing the knowledge base
+    near = np.asarray(scored.embeddings[rng.integers(0, n, n_queries)], dtype=np.float32)
+    query_embs = rag._unit_rows(near + 0.03 * rng.standard_normal(near.shape))
+    print(f"\nANN: {n_queries} queries against {n} passages, k={k}")
+
+    exact_rows = [{row for row, _ in hits} for hits in scored.search(query_embs, k)]
+    samples = []
+    for q in query_embs:
+        start = time.perf_counter()
+        scored.search(q[None, :], k)
+        samples.append(time.perf_counter() - start)
+    _summary("exact top_k", samples)
+
+    lists = rag.ANN_LISTS or None
+    ivf, elapsed = _timed(lambda: rag.ann.IVFIndex.build(scored.embeddings, lists, rag.ANN_DTYPE))
+    float_bytes = n * scored.embeddings.shape[1] * 4
+    print(f"IVF build: {elapsed:.2f} s, {ivf.n_lists} lists, {ivf.dtype}, "
+          f"{ivf.nbytes / 2**20:.1f} MiB vs {float_bytes / 2**20:.1f} MiB float32")
+
+    scored.ann = ivf
+    for probes in probe_counts:
+        scored.ann_probes = probes
+        samples, hit = [], 0
+        for q, truth in zip(query_embs, exact_rows):
+            start = time.perf_counter()
+            hits = scored.search(q[None, :], k)[0]
+            samples.append(time.perf_counter() - start)
+            hit += len(truth & {row for row, _ in hits})
+        _summary(f"ivf probes={probes}", samples)
+        print(f"{'':<24} recall@{k}={hit / (k * n_queries):.3f}")
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
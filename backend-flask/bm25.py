@@ -0,0 +1,145 @@
+"""
+Pure-Python BM25 (Okapi) retrieval over an inverted index.
+
+No model and no NumPy: used by rag.py as the lexical backend on small
+instances and as the fallback when sentence-transformers isn't installed.
+
+Serialised as two files next to the rest of the RAG index:
+  bm25.bin   uint32 little-endian: doc lengths, then (doc, tf) posting pairs
+  bm25.json  parameters, counts and term -> [first posting, posting count]
+"""
+import heapq
+import json
+import math
+import os
+import re
+import sys
+from array import array
+from collections import Counter
+
+K1 = 1.5
+B = 0.75
+BIN_FILE = 'bm25.bin'
+TERMS_FILE = 'bm25.json'
+
+# Latin words plus the Indic script blocks (Devanagari .. Malayalam) whose
+# vowel signs \w alone would split words on
+TOKEN_RE = re.compile(r"[\w\u0900-\u0D7F]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it its my
+of on or should so that the their there these this to was what when where
+which who why will with you your me we our they them
+""".split())
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        # Light plural folding: calves/cows/udders -> calve/cow/udder
+        if token.endswith('ies') and len(token) > 4:
+            token = token[:-3] + 'y'
+        elif token.endswith('s') and not token.endswith(('ss', 'is', 'us')) and len(token) > 3:
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _uint32(values=()):
+    arr = array('I', values)
+    if arr.itemsize != 4:
+        arr = array('L', values)
+    return arr
+
+
+class BM25Index:
+    def __init__(self, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        self.terms = {}              # term -> (first posting, posting count)
+        self.postings = _uint32()    # flattened (doc, tf) pairs, grouped by term
+        self.doc_len = _uint32()
+        self.avgdl = 0.0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts, k1=K1, b=B):
+        index = cls(k1, b)
+        inverted = {}
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            index.doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                inverted.setdefault(term, []).extend((doc, tf))
+        for term in sorted(inverted):
+            pairs = inverted[term]
+            index.terms[term] = (len(index.postings) // 2, len(pairs) // 2)
+            index.postings.extend(pairs)
+        index.avgdl = (sum(index.doc_len) / len(index.doc_len)) if index.doc_len else 0.0
+        return index
+
+    def search(self, query, k=3):
+        """[(doc, score)] of the k best matches, best first; [] when no term matches"""
+        n = len(self.doc_len)
+        if not n:
+            return []
+        k1, b, avgdl = self.k1, self.b, self.avgdl or 1.0
+        postings, doc_len = self.postings, self.doc_len
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            first, count = entry
+            idf = math.log(1 + (n - count + 0.5) / (count + 0.5))
+            for i in range(first * 2, (first + count) * 2, 2):
+                doc, tf = postings[i], postings[i + 1]
+                norm = k1 * (1 - b + b * doc_len[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, index_dir, write=None):
+        """
+        Write bm25.bin / bm25.json into index_dir; returns the metadata to keep
+        in the caller's manifest. `write(path, writer)` lets the caller write
+        atomically.
+        """
+        write = write or _write_plain
+        doc_len, postings = self.doc_len, self.postings
+        if sys.byteorder == 'big':
+            doc_len, postings = _uint32(doc_len), _uint32(postings)
+            doc_len.byteswap()
+            postings.byteswap()
+        write(os.path.join(index_dir, BIN_FILE),
+              lambda f: (f.write(doc_len.tobytes()), f.write(postings.tobytes())))
+        terms = {'k1': self.k1, 'b': self.b, 'avgdl': self.avgdl, 'docs': len(self.doc_len),
+                 'postings': len(self.postings) // 2, 'terms': self.terms}
+        write(os.path.join(index_dir, TERMS_FILE), lambda f: f.write(json.dumps(terms).encode('utf-8')))
+        return {'docs': len(self.doc_len), 'terms': len(self.terms), 'files': [BIN_FILE, TERMS_FILE]}
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, TERMS_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(meta['k1'], meta['b'])
+        index.avgdl = meta['avgdl']
+        index.terms = {term: tuple(entry) for term, entry in meta['terms'].items()}
+        data = _uint32()
+        with open(os.path.join(index_dir, BIN_FILE), 'rb') as f:
+            data.frombytes(f.read())
+        if sys.byteorder == 'big':
+            data.byteswap()
+        docs = meta['docs']
+        if len(data) != docs + meta['postings'] * 2:
+            raise ValueError("bm25.bin does not match bm25.json")
+        index.doc_len = data[:docs]
+        index.postings = data[docs:]
+        return index
+
+
+def _write_plain(path, writer):
+    with open(path, 'wb') as f:
+        writer(f)
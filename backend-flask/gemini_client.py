@@ -0,0 +1,114 @@
+"""
+Lazily configured, shared Gemini client.
+
+Nothing here touches the network at import time: the API key is read and the
+model list fetched on first use, so app startup (and the non-chat routes)
+work even when GEMINI_API_KEY is missing or Google is unreachable. The chosen
+model name is refreshed every MODEL_REFRESH_SECONDS and the GenerativeModel
+object is reused across requests.
+"""
+import os
+import threading
+import time
+
+import google.generativeai as genai
+
+MODEL_REFRESH_SECONDS = int(os.getenv("GEMINI_MODEL_REFRESH", str(6 * 60 * 60)))
+RETRY_SECONDS = 60   # retry discovery sooner after a failed list_models()
+FALLBACK_MODEL = "gemini-1.5-flash"   # Final fallback (supports vision)
+
+# Try common model names in order of preference (including vision models)
+# Use gemini-2 models first as they're more capable
+PREFERRED_MODELS = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
+
+_lock = threading.Lock()
+_configured_key = None
+_model_name = None
+_resolved_at = None
+_refresh_after = MODEL_REFRESH_SECONDS
+_models = {}   # model name -> GenerativeModel
+
+
+def api_key():
+    return os.getenv("GEMINI_API_KEY")
+
+
+def ensure_configured():
+    global _configured_key
+    key = api_key()
+    if not key:
+        raise ValueError("GEMINI_API_KEY not found in .env file. Please check your .env file in backend-flask directory.")
+    if key != _configured_key:
+        genai.configure(api_key=key)
+        _configured_key = key
+        print(f"✅ Gemini API key loaded successfully (length: {len(key)})")
+
+
+def available_model_names():
+    """Names of models supporting generateContent (network call)"""
+    ensure_configured()
+    return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+
+def _pick_model(available):
+    # Index by short name once, then walk the preference list: O(n + m)
+    short_names = {}
+    for name in available:
+        short_names.setdefault(name.split('/')[-1], name)
+    for pref in PREFERRED_MODELS:
+        if pref in short_names:
+            return pref
+    # Looser match (e.g. versioned "gemini-2.5-flash-001") in preference order
+    for pref in PREFERRED_MODELS:
+        for short in short_names:
+            if short.startswith(pref):
+                return short
+    if available:
+        return available[0].split('/')[-1]
+    return FALLBACK_MODEL
+
+
+def model_name(force_refresh=False):
+    """Current model name, discovered on first use and refreshed periodically"""
+    global _model_name, _resolved_at, _refresh_after
+    now = time.monotonic()
+    if not force_refresh and _model_name and now - _resolved_at < _refresh_after:
+        return _model_name
+
+    with _lock:
+        if not force_refresh and _model_name and now - _resolved_at < _refresh_after:
+            return _model_name
+        try:
+            available = available_model_names()
+            print(f"📋 Available models with generateContent: {available}")
+            name = _pick_model(available)
+            _refresh_after = MODEL_REFRESH_SECONDS
+        except Exception as e:
+            print(f"⚠️ Could not list models: {e}")
+            name = _model_name or FALLBACK_MODEL
+            _refresh_after = RETRY_SECONDS
+        if name != _model_name:
+            print(f"🤖 Using model: {name}")
+        _model_name = name
+        _resolved_at = now
+        return _model_name
+
+
+def get_model():
+    """Shared GenerativeModel for the current model name"""
+    ensure_configured()
+    name = model_name()
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = genai.GenerativeModel(name)
+                _models.clear()   # drop the object for a superseded model name
+                _models[name] = model
+    return model
+
+
+def current_model_name():
+    """Model name if already resolved, without triggering discovery"""
+    return _model_name
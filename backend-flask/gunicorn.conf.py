@@ -0,0 +1,35 @@
+"""
+Gunicorn settings, picked up automatically from backend-flask/.
+
+preload_app imports the app once in the master and forks the workers from
+it, so the RAG model weights and index are loaded once and shared
+copy-on-write instead of once per worker. GUNICORN_PRELOAD=false loads them
+per worker instead; RAG_WARMUP=false skips loading at boot altogether.
+Database connections opened by the preloaded import are not inherited: each
+worker discards the pool it got from the master in post_fork.
+"""
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def when_ready(server):
+    # Runs in the master after the (preloaded) app import, before any fork
+    if preload_app:
+        import rag
+        # Load only: no inference before fork, its thread pools don't survive it
+        rag.warmup(encode=False)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # The preloaded import ran create_all()/migrations in the master, so its
+        # pool holds open MySQL connections. Drop them (without closing the
+        # master's sockets) so this worker opens its own instead of sharing one.
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+    import rag
+    rag.warmup(encode=True)
@@ -0,0 +1,91 @@
+"""
+Normalise chat photo uploads before they are sent to Gemini.
+
+Phones send 4-12 MB JPEG/HEIC-sized photos; Gemini only needs roughly a
+1024 px image to see an animal's condition. normalise() sniffs the real
+format from the bytes (never trusting the data URL / client mime), applies
+the EXIF orientation, downscales so the longest edge is at most
+IMAGE_MAX_EDGE, and re-encodes as JPEG or WebP at IMAGE_QUALITY, lowering
+the quality until the result fits IMAGE_MAX_BYTES.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))   # raw upload limit
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(512 * 1024)))                      # after re-encoding
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()    # JPEG | WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_MIN_QUALITY = 40
+IMAGE_MAX_PIXELS = 50_000_000   # refuse decompression bombs before decoding
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF", "MPO"}
+
+
+class ImageRejected(ValueError):
+    """The upload is not an image we accept; the message is safe to show the user"""
+
+
+def normalise(data):
+    """
+    (bytes, mime_type, info) for the raw upload (bytes or a binary file
+    object), ready for Gemini. Raises ImageRejected for oversized,
+    unreadable or unsupported images.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        stream, size = io.BytesIO(data), len(data)
+    else:
+        stream = data
+        stream.seek(0, io.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+    if size > IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageRejected(f"Image is too large ({size // (1024 * 1024)} MB). "
+                            f"Please send a photo under {IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    try:
+        image = Image.open(stream)
+        source_format = image.format
+        if source_format not in ACCEPTED_FORMATS:
+            raise ImageRejected("Unsupported image format. Please send a JPEG, PNG or WebP photo.")
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise ImageRejected("Image resolution is too large. Please send a smaller photo.")
+        # draft() lets the JPEG decoder downscale by 2/4/8 while decoding
+        image.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # Flatten transparency onto white instead of black
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+    except ImageRejected:
+        raise
+    except Exception as e:
+        raise ImageRejected("Could not read the image. Please send a JPEG, PNG or WebP photo.") from e
+
+    out_format = IMAGE_FORMAT if IMAGE_FORMAT in MIME_TYPES else "JPEG"
+    quality = IMAGE_QUALITY
+    while True:
+        buffer = io.BytesIO()
+        if out_format == "JPEG":
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            image.save(buffer, "WEBP", quality=quality, method=4)
+        encoded = buffer.getvalue()
+        if len(encoded) <= IMAGE_MAX_BYTES or quality <= IMAGE_MIN_QUALITY:
+            break
+        quality -= 10
+    if len(encoded) > IMAGE_MAX_BYTES:
+        raise ImageRejected("Image is too detailed to process. Please send a smaller photo.")
+
+    info = {
+        "source_format": source_format,
+        "source_bytes": size,
+        "bytes": len(encoded),
+        "size": image.size,
+        "quality": quality,
+    }
+    return encoded, MIME_TYPES[out_format], info
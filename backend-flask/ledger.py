@@ -0,0 +1,187 @@
+from datetime import datetime
+from typing import Dict, Iterable
+
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CustomerBalance, MilkCollection, Payment
+
+# Incrementally maintained per-customer totals (customer_balances table).
+# The milk/payment routes call record_milk() / record_payment() with the
+# change they are making, inside the same transaction, before commit.
+# Rows that do not exist yet (old data, new customers) are rebuilt from the
+# source tables on first touch, so the summary never needs a manual backfill.
+# Two requests creating the same row race on its primary key; the loser rolls
+# back to a savepoint and applies its change to the winner's row instead.
+
+
+def as_float(value):
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _apply(customer_id, deltas):
+    if not customer_id:
+        return
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+
+    if not _bump(customer_id, deltas) and not _create_balances([customer_id]):
+        # A concurrent request created the row first; its totals don't
+        # include this (uncommitted) change, so add it as a delta
+        _bump(customer_id, deltas)
+
+
+def _bump(customer_id, deltas):
+    """Atomic "col = col + delta" so concurrent writers don't lose updates; rows updated"""
+    values = {getattr(CustomerBalance, k): getattr(CustomerBalance, k) + v for k, v in deltas.items()}
+    values[CustomerBalance.updated_at] = datetime.utcnow()
+    return (
+        CustomerBalance.query
+        .filter_by(customer_id=customer_id)
+        .update(values, synchronize_session=False)
+    )
+
+
+def _create_balances(customer_ids):
+    """
+    Build missing summary rows from the source tables (autoflush makes the
+    pending change part of that computation). False when another
+    transaction inserted one of them first; nothing is kept in that case.
+    """
+    try:
+        with db.session.begin_nested():
+            rebuild_balances(customer_ids)
+        return True
+    except IntegrityError:
+        return False
+
+
+def record_milk(customer_id, quantity=0, amount=0, entries=0):
+    """Apply a milk collection change (positive to add, negative to remove)"""
+    _apply(customer_id, {
+        "milk_quantity": as_float(quantity),
+        "milk_amount": as_float(amount),
+        "milk_entries": entries,
+    })
+
+
+def record_payment(customer_id, amount=0, entries=0):
+    """Apply a payment change (positive to add, negative to remove)"""
+    _apply(customer_id, {
+        "amount_paid": as_float(amount),
+        "payment_entries": entries,
+    })
+
+
+def record_milk_batch(totals):
+    """
+    Apply many milk deltas at once: totals = {customer_id: (quantity, amount, entries)}.
+    Existing summary rows are bumped with a single UPDATE ... CASE statement,
+    missing ones are rebuilt from the source tables.
+    """
+    totals = {cid: t for cid, t in totals.items() if cid}
+    if not totals:
+        return
+
+    ids = list(totals)
+    existing = {
+        cid for (cid,) in db.session.query(CustomerBalance.customer_id)
+        .filter(CustomerBalance.customer_id.in_(ids))
+    }
+    if existing:
+        def bump(column, pos):
+            delta = case(
+                {cid: totals[cid][pos] for cid in existing},
+                value=CustomerBalance.customer_id,
+                else_=0
+            )
+            return column + delta
+
+        db.session.execute(
+            update(CustomerBalance)
+            .where(CustomerBalance.customer_id.in_(existing))
+            .values(
+                milk_quantity=bump(CustomerBalance.milk_quantity, 0),
+                milk_amount=bump(CustomerBalance.milk_amount, 1),
+                milk_entries=bump(CustomerBalance.milk_entries, 2),
+                updated_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    missing = [cid for cid in ids if cid not in existing]
+    if missing and not _create_balances(missing):
+        # Lost a creation race: the rows that exist now get the delta
+        record_milk_batch({cid: totals[cid] for cid in missing})
+
+
+def backfill_balances(customer_ids: Iterable[int]) -> Dict[int, CustomerBalance]:
+    """
+    rebuild_balances() + commit for requests that only read (balance routes).
+    If a concurrent request inserts one of the rows first, roll back and
+    rebuild in a fresh transaction, which sees that row and updates it.
+    """
+    ids = list(customer_ids)
+    for attempt in range(3):
+        try:
+            built = rebuild_balances(ids)
+            db.session.commit()
+            return built
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 2:
+                raise
+
+
+def rebuild_balances(customer_ids: Iterable[int]) -> Dict[int, CustomerBalance]:
+    """Recompute summary rows for the given customers from milk/payment rows"""
+    ids = [cid for cid in set(customer_ids) if cid]
+    if not ids:
+        return {}
+
+    milk = {
+        row.customer_id: row
+        for row in db.session.query(
+            MilkCollection.customer_id,
+            func.coalesce(func.sum(MilkCollection.quantity), 0).label("quantity"),
+            func.coalesce(func.sum(MilkCollection.total_price), 0).label("amount"),
+            func.count(MilkCollection.id).label("entries"),
+        )
+        .filter(MilkCollection.customer_id.in_(ids))
+        .group_by(MilkCollection.customer_id)
+    }
+    paid = {
+        row.customer_id: row
+        for row in db.session.query(
+            Payment.customer_id,
+            func.coalesce(func.sum(Payment.amount_paid), 0).label("amount"),
+            func.count(Payment.id).label("entries"),
+        )
+        .filter(Payment.customer_id.in_(ids))
+        .group_by(Payment.customer_id)
+    }
+    existing = {
+        b.customer_id: b
+        for b in CustomerBalance.query.filter(CustomerBalance.customer_id.in_(ids))
+    }
+
+    result = {}
+    for cid in ids:
+        balance = existing.get(cid)
+        if balance is None:
+            balance = CustomerBalance(customer_id=cid)
+            db.session.add(balance)
+        m = milk.get(cid)
+        p = paid.get(cid)
+        balance.milk_quantity = float(m.quantity) if m else 0.0
+        balance.milk_amount = float(m.amount) if m else 0.0
+        balance.milk_entries = m.entries if m else 0
+        balance.amount_paid = float(p.amount) if p else 0.0
+        balance.payment_entries = p.entries if p else 0
+        balance.updated_at = datetime.utcnow()
+        result[cid] = balance
+    return result
@@ -0,0 +1,96 @@
+"""
+Concurrent load test for the chatbot endpoint.
+
+Fires N requests at /chat/chatbot with C in flight at a time and reports
+throughput and latency percentiles. Run it once against the WSGI app and once
+against the ASGI app to compare:
+
+    gunicorn app:app --workers 2 --timeout 120 --bind 0.0.0.0:5000
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker --workers 2 --timeout 120 --bind 0.0.0.0:5000
+
+    python loadtest_chat.py --url http://localhost:5000 --requests 200 --concurrency 50
+
+Set ANSWER_CACHE_ENABLED=false on the server, otherwise the similar test
+questions are answered from the cache instead of Gemini.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import aiohttp
+
+QUESTIONS = [
+    "How much milk should a cow give per day?",
+    "What should I feed a buffalo in summer?",
+    "How do I increase the fat content of milk?",
+    "When should a calf be vaccinated?",
+    "How can I keep milk fresh without a fridge?",
+]
+
+
+async def _one(session, url, i, results):
+    body = {
+        "message": f"{QUESTIONS[i % len(QUESTIONS)]} ({i})",
+        "language": "en",
+        "session_id": f"loadtest-{uuid.uuid4().hex}"
+    }
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json=body) as resp:
+            await resp.read()
+            ok = resp.status == 200
+    except aiohttp.ClientError:
+        ok = False
+    results.append((time.perf_counter() - start, ok))
+
+
+async def run(base_url, total, concurrency, timeout):
+    url = base_url.rstrip("/") + "/chat/chatbot"
+    results = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(session, i):
+        async with slots:
+            await _one(session, url, i, results)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(session, i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def report(results, elapsed):
+    latencies = [lat for lat, ok in results if ok]
+    failures = sum(1 for _, ok in results if not ok)
+    print(f"requests:    {len(results)} ({failures} failed)")
+    print(f"elapsed:     {elapsed:.2f}s")
+    print(f"throughput:  {len(latencies) / elapsed:.2f} req/s")
+    if latencies:
+        print(f"latency p50: {_percentile(latencies, 50) * 1000:.0f} ms")
+        print(f"latency p95: {_percentile(latencies, 95) * 1000:.0f} ms")
+        print(f"latency max: {max(latencies) * 1000:.0f} ms")
+        print(f"latency avg: {statistics.mean(latencies) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /chat/chatbot")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    results, elapsed = asyncio.run(run(args.url, args.requests, args.concurrency, args.timeout))
+    report(results, elapsed)
@@ -0,0 +1,186 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables, so anything added to an existing
+table (indexes, columns) goes here as a numbered migration. Applied versions
+are recorded in the schema_migrations table and each one runs exactly once.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # list applied / pending versions
+    python migrations.py explain    # EXPLAIN the hot data-route queries
+"""
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+from models import db, Customer, MilkCollection, Payment
+
+
+def _create_index(conn, table, name, columns):
+    """CREATE INDEX unless an index with that name already exists"""
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(table)}
+    if name in existing:
+        return
+    cols = ", ".join(columns)
+    try:
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({cols})"))
+    except (OperationalError, ProgrammingError) as e:
+        # Another worker created it between the check and the CREATE
+        if "exist" not in str(e).lower() and "duplicate" not in str(e).lower():
+            raise
+
+
+def _001_hot_path_indexes(conn):
+    _create_index(conn, "customers", "ix_customers_user_id", ["user_id"])
+    _create_index(conn, "milk_collection", "ix_milk_collection_customer_date", ["customer_id", "date"])
+    _create_index(conn, "payments", "ix_payments_customer_date", ["customer_id", "date"])
+
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, "indexes on customers.user_id and (customer_id, date)", _001_hot_path_indexes),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(255), "
+        "applied_at DATETIME)"
+    ))
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_migrations(engine=None):
+    """Apply every pending migration; returns the list of versions applied"""
+    engine = engine or db.engine
+    applied = []
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    for version, description, func in MIGRATIONS:
+        if version in done:
+            continue
+        # One transaction per migration (MySQL DDL auto-commits anyway)
+        with engine.begin() as conn:
+            func(conn)
+            try:
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": version, "d": description, "t": datetime.utcnow()}
+                )
+            except IntegrityError:
+                # Applied concurrently by another worker
+                pass
+        print(f"✅ Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# ---------------- EXPLAIN CHECK ---------------- #
+
+def _hot_queries(user_id=1, customer_id=1, record_id=1):
+    """The queries the data routes run on every list / update / delete call"""
+    period_start, period_end = date(2024, 1, 1), date(2024, 1, 10)
+    return {
+        "list milk": db.session.query(MilkCollection).join(Customer)
+            .filter(Customer.user_id == user_id)
+            .order_by(MilkCollection.date.desc(), MilkCollection.id.desc()),
+        "list payments": db.session.query(Payment).join(Customer)
+            .filter(Customer.user_id == user_id)
+            .order_by(Payment.date.desc(), Payment.id.desc()),
+        "customer milk history": db.session.query(MilkCollection)
+            .filter(MilkCollection.customer_id == customer_id)
+            .order_by(MilkCollection.date.desc()),
+        "customer payment history": db.session.query(Payment)
+            .filter(Payment.customer_id == customer_id)
+            .order_by(Payment.date.desc()),
+        "settlement period (milk)": db.session.query(MilkCollection).join(Customer)
+            .filter(Customer.user_id == user_id, MilkCollection.customer_id == customer_id,
+                    MilkCollection.date >= period_start, MilkCollection.date <= period_end),
+        "update/delete milk": db.session.query(MilkCollection).join(Customer)
+            .filter(MilkCollection.id == record_id, Customer.user_id == user_id),
+        "update/delete payment": db.session.query(Payment).join(Customer)
+            .filter(Payment.id == record_id, Customer.user_id == user_id),
+    }
+
+
+def explain_hot_queries():
+    """
+    Run EXPLAIN on each hot query and report the index used per table.
+    Returns {name: [{"table", "index", "full_scan"}]}; supports MySQL and SQLite.
+    """
+    dialect = db.engine.dialect
+    report = {}
+    for name, query in _hot_queries().items():
+        sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+        steps = []
+        if dialect.name == "sqlite":
+            for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql)):
+                detail = row[-1]
+                if not detail.startswith(("SCAN", "SEARCH")):
+                    continue
+                words = detail.split()
+                # Older SQLite says "SCAN TABLE x" / "SEARCH TABLE x", newer "SCAN x"
+                table = words[2] if len(words) > 2 and words[1] == "TABLE" else words[1]
+                index = None
+                if "INDEX" in words:
+                    index = words[words.index("INDEX") + 1]
+                elif "PRIMARY" in words or "INTEGER PRIMARY KEY" in detail:
+                    index = "PRIMARY"
+                steps.append({
+                    "table": table,
+                    "index": index,
+                    "full_scan": words[0] == "SCAN" and index is None
+                })
+        else:
+            result = db.session.execute(text("EXPLAIN " + sql))
+            keys = list(result.keys())
+            for row in result:
+                row = dict(zip(keys, row))
+                steps.append({
+                    "table": row.get("table"),
+                    "index": row.get("key"),
+                    "full_scan": row.get("type") == "ALL"
+                })
+        report[name] = steps
+    return report
+
+
+def _main(argv):
+    from app import app
+
+    command = argv[1] if len(argv) > 1 else "migrate"
+    with app.app_context():
+        if command == "migrate":
+            applied = run_migrations()
+            print(f"Migrations applied: {applied or 'none (up to date)'}")
+        elif command == "status":
+            with db.engine.begin() as conn:
+                done = applied_versions(conn)
+            for version, description, _ in MIGRATIONS:
+                state = "applied" if version in done else "pending"
+                print(f"{version:>4}  {state:<8} {description}")
+        elif command == "explain":
+            ok = True
+            for name, steps in explain_hot_queries().items():
+                for step in steps:
+                    flag = "❌ FULL SCAN" if step["full_scan"] else "✅"
+                    ok = ok and not step["full_scan"]
+                    print(f"{flag} {name}: {step['table']} -> {step['index']}")
+            return 0 if ok else 1
+        else:
+            print(__doc__)
+            return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
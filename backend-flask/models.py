@@ -19,18 +19,32 @@ class User(db.Model):
     def __repr__(self):
         return f"<User {self.email}>"
 
+class UserTokenVersion(db.Model):
+    """
+    Per-user JWT version. Bumping it revokes every token issued before.
+    No FK on purpose: deleted users keep their row so their tokens stay revoked.
+    """
+    __tablename__ = 'user_token_versions'
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Customer(db.Model):
     __tablename__ = 'customers'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     phone = db.Column(db.String(15))
     address = db.Column(db.Text)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     milk_records = db.relationship('MilkCollection', backref='customer', cascade="all, delete")
     payments = db.relationship('Payment', backref='customer', cascade="all, delete")
+    balance = db.relationship('CustomerBalance', backref='customer', uselist=False, cascade="all, delete")
 
 class MilkCollection(db.Model):
     __tablename__ = 'milk_collection'
+    # (customer_id, date) serves the per-customer listings and date ranges;
+    # existing databases get it from migrations.py
+    __table_args__ = (db.Index('ix_milk_collection_customer_date', 'customer_id', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'))
     date = db.Column(db.Date)
@@ -41,12 +55,24 @@ class MilkCollection(db.Model):
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (db.Index('ix_payments_customer_date', 'customer_id', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'))
     amount_paid = db.Column(db.Float)
     date = db.Column(db.Date)
     payment_mode = db.Column(db.Enum('cash', 'upi', 'bank'), default='cash')
 
+class CustomerBalance(db.Model):
+    """Per-customer running totals, maintained incrementally by ledger.py"""
+    __tablename__ = 'customer_balances'
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), primary_key=True)
+    milk_quantity = db.Column(db.Float, nullable=False, default=0)
+    milk_amount = db.Column(db.Float, nullable=False, default=0)
+    amount_paid = db.Column(db.Float, nullable=False, default=0)
+    milk_entries = db.Column(db.Integer, nullable=False, default=0)
+    payment_entries = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
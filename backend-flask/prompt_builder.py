@@ -0,0 +1,130 @@
+"""
+Token-budgeted prompt assembly for the chatbot.
+
+The prompt is filled in priority order under PROMPT_TOKEN_BUDGET:
+  1. system prompt + the current question (always included)
+  2. retrieved RAG passages, best first, each whole or not at all
+  3. conversation history: the newest messages verbatim, older turns folded
+     into a one-line summary of what the user asked, dropped if even that
+     doesn't fit
+
+Token counts are estimated locally (no count_tokens round trip): ~4 chars
+per token for ASCII text, ~2 for Indic scripts.
+"""
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+HISTORY_RECENT_MESSAGES = 6      # newest messages kept verbatim when they fit
+HISTORY_MESSAGE_CHARS = 400      # per verbatim message
+SUMMARY_TOPIC_CHARS = 80         # per older question in the summary line
+IMAGE_TOKENS = 258               # Gemini's fixed cost for an attached image
+
+HISTORY_INSTRUCTIONS = """**CRITICAL:** This is a FOLLOW-UP question in an ongoing conversation.
+- Build upon previous context
+- Provide NEW information, NOT repetition
+- If user asks for "more details", expand with DIFFERENT aspects not covered before
+- Reference previous discussion only to connect new information"""
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "..."
+
+
+def _format_message(msg):
+    return f"{msg['role'].upper()}: {_clip(msg['content'], HISTORY_MESSAGE_CHARS)}"
+
+
+def _summary(messages):
+    """One line naming the earlier questions, or '' when there are none"""
+    topics = [_clip(m["content"], SUMMARY_TOPIC_CHARS) for m in messages if m["role"] == "user"]
+    if not topics:
+        return ""
+    return "Earlier in this conversation the user asked about: " + "; ".join(topics)
+
+
+def _history_block(summary, lines):
+    parts = [summary] if summary else []
+    return "**CONVERSATION HISTORY:**\n" + "\n".join(parts + lines) + "\n\n" + HISTORY_INSTRUCTIONS
+
+
+def _context_block(lines):
+    return "\n\n---\nRelevant documents for context:\n" + "\n---\n".join(lines) + "\n\n"
+
+
+def build(system_prompt, question, lang_name, passages=(), history=(), has_image=False,
+          budget=PROMPT_TOKEN_BUDGET):
+    """
+    (prompt, stats) for one chat turn. passages are rag.retrieve_passages()
+    dicts, history the session's [{'role', 'content'}] messages, oldest first.
+    """
+    tail = f"\n\n**User Question:** {question}\n\n**Your Response (in {lang_name}):**"
+    used = estimate_tokens(system_prompt) + estimate_tokens(tail) + (IMAGE_TOKENS if has_image else 0)
+
+    # Passages: whole ones only, in rank order
+    passage_lines = []
+    header_cost = estimate_tokens(_context_block([]) + "\n\n**Reference Documents:**\n")
+    for p in passages:
+        line = f"- [{p['source']}] {p['text']}"
+        cost = estimate_tokens(line) + 2 + (0 if passage_lines else header_cost)
+        if used + cost <= budget:
+            passage_lines.append(line)
+            used += cost
+
+    # History: newest messages verbatim, the rest summarised (or dropped)
+    history = list(history)
+    recent, older = [], history
+    if history:
+        used += estimate_tokens(_history_block("", []))
+        candidates = history[-HISTORY_RECENT_MESSAGES:]
+        older = history[:-HISTORY_RECENT_MESSAGES]
+        for i in range(len(candidates) - 1, -1, -1):
+            line = _format_message(candidates[i])
+            cost = estimate_tokens(line) + 1
+            if used + cost > budget:
+                older = older + candidates[:i + 1]
+                break
+            recent.insert(0, line)
+            used += cost
+
+    summary = ""
+    summarised = older
+    while summarised:
+        summary = _summary(summarised)
+        if not summary or used + estimate_tokens(summary) + 1 <= budget:
+            break
+        summarised = summarised[1:]   # forget the oldest turn first
+        summary = ""
+    used += estimate_tokens(summary) + 1 if summary else 0
+
+    history_block = ""
+    if recent or summary:
+        history_block = _history_block(summary, recent)
+    elif history:
+        used -= estimate_tokens(_history_block("", []))
+
+    prompt = system_prompt
+    if history_block:
+        prompt += "\n\n" + history_block
+    if passage_lines:
+        prompt += "\n\n**Reference Documents:**\n" + _context_block(passage_lines)
+    prompt += tail
+
+    summarised_count = len(summarised) if summary else 0
+    stats = {
+        "tokens": estimate_tokens(prompt) + (IMAGE_TOKENS if has_image else 0),
+        "budget": budget,
+        "passages": len(passage_lines),
+        "passages_dropped": len(passages) - len(passage_lines),
+        "history_verbatim": len(recent),
+        "history_summarised": summarised_count,
+        "history_dropped": len(older) - summarised_count,
+    }
+    return prompt, stats
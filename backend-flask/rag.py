@@ -1,129 +1,619 @@
 import os
+import sys
 import glob
-import pickle
-from typing import List
+import hashlib
+import heapq
+import json
+import threading
+import time
+from typing import Dict, List
+
+from answer_cache import normalise
+from bm25 import BM25Index
+from cache import TTLCache
 
 try:
-    from sentence_transformers import SentenceTransformer
-    from sklearn.neighbors import NearestNeighbors
     import numpy as np
+    import ann
 except Exception:
-    # When dependencies are missing, the module will still import but retrieval will be a no-op.
-    SentenceTransformer = None
-    NearestNeighbors = None
     np = None
+    ann = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except Exception:
+    # Without it the dense backend is unavailable and retrieval falls back to BM25
+    SentenceTransformer = None
 
 BASE_DIR = os.path.dirname(__file__)
 KNOWLEDGE_DIR = os.path.join(BASE_DIR, 'knowledge')
-INDEX_FILE = os.path.join(BASE_DIR, 'rag_index.pkl')
-
 MODEL_NAME = 'paraphrase-MiniLM-L6-v2'
 
+# Retrieval backend:
+#   dense   sentence-transformers embeddings (keeps the model in memory)
+#   bm25    lexical BM25, no model - for small instances
+#   hybrid  both, merged with reciprocal rank fusion
+#   auto    dense when sentence-transformers is installed, otherwise bm25
+BACKEND = os.getenv('RAG_BACKEND', 'auto').lower()
+BACKENDS = ('dense', 'bm25', 'hybrid')
+RRF_K = 60                # reciprocal rank fusion constant
+HYBRID_CANDIDATES = 20    # hits taken from each backend before fusing
+
+# Approximate (IVF, quantised) dense search for large knowledge bases, see ann.py.
+# RAG_ANN=auto builds it from RAG_ANN_MIN_PASSAGES passages; on / off force it.
+ANN_MODE = os.getenv('RAG_ANN', 'auto').lower()
+ANN_MIN_PASSAGES = int(os.getenv('RAG_ANN_MIN_PASSAGES', '20000'))
+ANN_DTYPE = os.getenv('RAG_ANN_DTYPE', 'int8')            # int8 | float16
+ANN_LISTS = int(os.getenv('RAG_ANN_LISTS', '0'))          # 0 = about sqrt(passages)
+ANN_PROBES = int(os.getenv('RAG_ANN_PROBES', '8'))        # lists scanned per query
+ANN_RERANK = 4    # candidates per requested hit, re-scored exactly
+
+# Knowledge files are split into overlapping passages of about this many chars
+CHUNK_CHARS = int(os.getenv('RAG_CHUNK_CHARS', '600'))
+CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '100'))
+
+# Query embeddings memoised by normalised text (model-specific, not index-specific)
+QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '2048'))
+QUERY_CACHE_TTL = int(os.getenv('RAG_QUERY_CACHE_TTL', str(24 * 60 * 60)))
+
+# Used when knowledge/ is empty
+DEFAULT_DOCS = [
+    "General dairy farming best practices: maintain hygiene, provide clean water, balanced feed, monitor udder health, vaccinate regularly.",
+    "Mastitis management: isolate affected animal, consult vet, sample milk for culture, follow recommended antibiotic regimen based on sensitivity testing."
+]
+DEFAULT_SOURCE = '(default)'
+
+# On-disk index (a directory, shared read-only by every worker):
+#   embeddings.npy  float32 matrix of unit-length rows, one per passage, opened with mmap
+#                   (only when a dense backend built the index)
+#   docs.txt        UTF-8 passage texts back to back
+#   bm25.bin/.json  lexical inverted index (see bm25.py)
+#   ann_*.npy       IVF partitions + quantised vectors (see ann.py), large indexes only
+#   manifest.json   format version, chunking, per-passage (offset, length,
+#                   source, chunk), embedding model, source file hashes, and the
+#                   size / mtime / sha256 of every data file
+INDEX_DIR = os.path.join(BASE_DIR, 'rag_index')
+INDEX_FORMAT_VERSION = 4
+EMBEDDINGS_FILE = 'embeddings.npy'
+DOCS_FILE = 'docs.txt'
+MANIFEST_FILE = 'manifest.json'
+# Loads check data files by size + mtime (a stat each) and only hash files whose
+# mtime moved; RAG_VERIFY_CHECKSUMS=true hashes everything, reading the whole index
+VERIFY_CHECKSUMS = os.getenv('RAG_VERIFY_CHECKSUMS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def dense_available():
+    return SentenceTransformer is not None and np is not None
+
+
+def resolve_backend(requested: str = BACKEND) -> str:
+    if requested not in BACKENDS:
+        return 'dense' if dense_available() else 'bm25'
+    if requested != 'bm25' and not dense_available():
+        print(f"⚠️ RAG_BACKEND={requested} needs sentence-transformers, falling back to bm25")
+        return 'bm25'
+    return requested
+
+
+def want_ann(n_passages: int) -> bool:
+    if ann is None or ANN_MODE == 'off':
+        return False
+    return ANN_MODE == 'on' or n_passages >= ANN_MIN_PASSAGES
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _verify_files(index_dir, manifest):
+    """True when every data file still matches what the manifest recorded"""
+    stats = manifest.get('stat', {})
+    for name, digest in manifest.get('sha256', {}).items():
+        path = os.path.join(index_dir, name)
+        recorded = stats.get(name)
+        if recorded and not VERIFY_CHECKSUMS:
+            current = _stat(path)
+            if current['size'] != recorded['size']:
+                return False
+            if current['mtime_ns'] == recorded['mtime_ns']:
+                continue
+        # Copied / touched file (or an older manifest): fall back to the hash
+        if _sha256(path) != digest:
+            return False
+    return True
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"   # concurrent builders don't clobber each other
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _fuse(rankings, k):
+    """Reciprocal rank fusion of [(doc, score)] rankings: sum of 1 / (RRF_K + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (RRF_K + rank)
+    return heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+
+
+def _unit_rows(matrix):
+    """float32 copy of matrix with every row scaled to length 1 (cosine = dot product)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into passages of at most `size` chars, each starting `overlap`
+    chars before the previous one ended. Cuts prefer paragraph, line, sentence
+    and then word boundaries.
+    """
+    text = text.strip()
+    if len(text) <= size:
+        return [text] if text else []
+
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for sep in ('\n\n', '\n', '. ', ' '):
+                pos = window.rfind(sep)
+                if pos > size // 2:
+                    end = start + pos + len(sep)
+                    break
+        passage = text[start:end].strip()
+        if passage:
+            passages.append(passage)
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Don't start the next passage mid-word
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return passages
+
+
+def _scan_knowledge(known: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    {file name: {sha256, size, mtime}} for knowledge/*.txt. Files whose size
+    and mtime match `known` keep their recorded hash without being re-read.
+    """
+    files = {}
+    if not os.path.isdir(KNOWLEDGE_DIR):
+        return files
+    for path in glob.glob(os.path.join(KNOWLEDGE_DIR, '*.txt')):
+        name = os.path.basename(path)
+        try:
+            st = os.stat(path)
+            old = known.get(name)
+            if old and old.get('size') == st.st_size and old.get('mtime') == st.st_mtime:
+                digest = old['sha256']
+            else:
+                digest = _sha256(path)
+        except OSError:
+            continue
+        files[name] = {'sha256': digest, 'size': st.st_size, 'mtime': st.st_mtime}
+    return files
+
+
+def save_store(passages: List[dict], embeddings, lexical: BM25Index, files: Dict[str, dict],
+               ann_index=None, index_dir: str = INDEX_DIR):
+    """Write passages, BM25 and (optional) embeddings / ANN in the versioned mmap-able format"""
+    os.makedirs(index_dir, exist_ok=True)
+
+    table = []
+    blob = bytearray()
+    for passage in passages:
+        data = passage['text'].encode('utf-8')
+        table.append([len(blob), len(data), passage['source'], passage['chunk']])
+        blob.extend(data)
+
+    _write_atomic(os.path.join(index_dir, DOCS_FILE), lambda f: f.write(bytes(blob)))
+    written = [DOCS_FILE]
+
+    dense = None
+    if embeddings is not None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        _write_atomic(os.path.join(index_dir, EMBEDDINGS_FILE),
+                      lambda f: np.save(f, embeddings, allow_pickle=False))
+        written.append(EMBEDDINGS_FILE)
+        dense = {'model': MODEL_NAME, 'dim': int(embeddings.shape[1]), 'dtype': 'float32'}
+
+    bm25_meta = lexical.save(index_dir, write=_write_atomic)
+    written.extend(bm25_meta.pop('files'))
+
+    ann_meta = None
+    if ann_index is not None:
+        ann_meta = ann_index.save(index_dir, write=_write_atomic)
+        written.extend(ann_meta.pop('files'))
+
+    # Manifest last: a reader never accepts data files it doesn't describe
+    manifest = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'chunking': {'chars': CHUNK_CHARS, 'overlap': CHUNK_OVERLAP},
+        'count': len(passages),
+        'passages': table,
+        'files': files,
+        'dense': dense,
+        'bm25': bm25_meta,
+        'ann': ann_meta,
+        'sha256': {name: _sha256(os.path.join(index_dir, name)) for name in written},
+        'stat': {name: _stat(os.path.join(index_dir, name)) for name in written},
+    }
+    _write_atomic(os.path.join(index_dir, MANIFEST_FILE),
+                  lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+    # Optional data files the new manifest doesn't describe (no embeddings,
+    # no ANN, or a float16 ANN without ann_scales.npy) are left over from an
+    # older build: remove them
+    optional = [EMBEDDINGS_FILE] + (list(ann.FILES) if ann is not None else [])
+    for name in optional:
+        path = os.path.join(index_dir, name)
+        if name not in written and os.path.exists(path):
+            os.remove(path)
+
+
+def load_store(index_dir: str = INDEX_DIR):
+    """
+    (passages, embeddings, bm25, ann, manifest) from the on-disk index, arrays
+    memory-mapped read-only so the OS page cache shares them across workers.
+    embeddings (and ann) are None when the index has none for MODEL_NAME. None overall
+    when the index is missing, corrupt, or was built with another format or
+    chunking.
+    """
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != INDEX_FORMAT_VERSION:
+            print(f"⚠️ RAG index format {manifest.get('format_version')} is stale, rebuilding")
+            return None
+        if manifest.get('chunking') != {'chars': CHUNK_CHARS, 'overlap': CHUNK_OVERLAP}:
+            print("⚠️ RAG index chunking settings changed, rebuilding")
+            return None
+
+        if not _verify_files(index_dir, manifest):
+            print("⚠️ RAG index files changed since it was built, rebuilding")
+            return None
+
+        with open(os.path.join(index_dir, DOCS_FILE), 'rb') as f:
+            blob = f.read()
+        passages = [
+            {'text': blob[start:start + length].decode('utf-8'), 'source': source, 'chunk': chunk}
+            for start, length, source, chunk in manifest['passages']
+        ]
+        if not passages:
+            return None
+
+        embeddings = None
+        dense = manifest.get('dense')
+        if dense and np is not None:
+            if dense.get('model') != MODEL_NAME:
+                print(f"⚠️ RAG embeddings were built with {dense.get('model')}, not {MODEL_NAME}; re-embedding")
+            else:
+                embeddings = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode='r', allow_pickle=False)
+                if embeddings.dtype != np.float32 or embeddings.shape[0] != len(passages):
+                    embeddings = None
+
+        lexical = BM25Index.load(index_dir) if manifest.get('bm25') else None
+        if lexical is not None and len(lexical) != len(passages):
+            lexical = None
+
+        ann_index = None
+        if manifest.get('ann') and embeddings is not None:
+            ann_index = ann.IVFIndex.load(index_dir, manifest['ann'])
+            if len(ann_index) != len(passages):
+                ann_index = None
+        return passages, embeddings, lexical, ann_index, manifest
+    except Exception as e:
+        print(f"⚠️ Could not read RAG index: {e}")
+        return None
+
 class RAGIndex:
-    def __init__(self):
+    def __init__(self, backend: str = BACKEND):
+        self.backend = resolve_backend(backend)
         self.model = None
         self.docs: List[str] = []
+        self.passages: List[dict] = []   # {'text', 'source', 'chunk'}, same order as docs
         self.embeddings = None
-        self.nn = None
+        self.bm25 = None
+        self.ann = None
+        self.ann_probes = ANN_PROBES
+        self.last_build = {}
+        self.query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
 
-    def available(self):
-        return SentenceTransformer is not None and NearestNeighbors is not None
+    @property
+    def uses_dense(self):
+        return self.backend in ('dense', 'hybrid')
 
-    def build(self):
-        if not self.available():
+    @property
+    def uses_bm25(self):
+        return self.backend in ('bm25', 'hybrid')
+
+    @property
+    def ready(self):
+        if not self.passages:
             return False
+        if self.uses_dense and (self.model is None or self.embeddings is None):
+            return False
+        return not self.uses_bm25 or self.bm25 is not None
+
+    def build(self):
+        """
+        (Re)build the index incrementally: passages and embeddings of
+        knowledge files whose hash is unchanged are reused from the stored
+        index, only changed or new files are chunked and embedded. The BM25
+        index is always rebuilt (cheap) so every stored index can serve bm25.
+        """
+        started = time.perf_counter()
 
         # Load model
-        self.model = SentenceTransformer(MODEL_NAME)
+        if self.uses_dense and self.model is None:
+            self.model = SentenceTransformer(MODEL_NAME)
+
+        # Reuse rows of the previous index, grouped by source file
+        previous = load_store()
+        old_files, old_rows, old_embs = {}, {}, None
+        if previous is not None:
+            old_passages, old_embs, _, _, manifest = previous
+            old_files = manifest.get('files', {})
+            for row, passage in enumerate(old_passages):
+                old_rows.setdefault(passage['source'], []).append(row)
 
-        # Read plain text files under knowledge/
-        docs = []
-        if os.path.isdir(KNOWLEDGE_DIR):
-            for path in glob.glob(os.path.join(KNOWLEDGE_DIR, '*.txt')):
+        files = _scan_knowledge(old_files)
+        passages, blocks = [], []
+        reused = indexed = embedded = 0
+        for name in sorted(files):
+            old = old_files.get(name)
+            block = None
+            if old and old['sha256'] == files[name]['sha256'] and name in old_rows:
+                rows = old_rows[name]
+                file_passages = [old_passages[row] for row in rows]
+                if self.uses_dense and old_embs is not None:
+                    block = np.asarray(old_embs[rows], dtype=np.float32)
+                reused += 1
+            else:
+                # Read plain text files under knowledge/
                 try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        text = f.read().strip()
-                        if text:
-                            docs.append(text)
+                    with open(os.path.join(KNOWLEDGE_DIR, name), 'r', encoding='utf-8') as f:
+                        chunks = chunk_text(f.read())
                 except Exception:
                     continue
+                file_passages = [{'text': c, 'source': name, 'chunk': i} for i, c in enumerate(chunks)]
+                indexed += 1
+            if self.uses_dense and block is None and file_passages:
+                block = _unit_rows(self.model.encode([p['text'] for p in file_passages],
+                                                     show_progress_bar=False, convert_to_numpy=True))
+                embedded += len(file_passages)
+            passages.extend(file_passages)
+            if block is not None:
+                blocks.append(block)
 
         # Fall back to a small default doc if none found
-        if not docs:
-            docs = [
-                "General dairy farming best practices: maintain hygiene, provide clean water, balanced feed, monitor udder health, vaccinate regularly.",
-                "Mastitis management: isolate affected animal, consult vet, sample milk for culture, follow recommended antibiotic regimen based on sensitivity testing." 
-            ]
+        if not passages:
+            passages = [{'text': d, 'source': DEFAULT_SOURCE, 'chunk': 0} for d in DEFAULT_DOCS]
+            blocks = []
+            if self.uses_dense:
+                blocks = [_unit_rows(self.model.encode(DEFAULT_DOCS, show_progress_bar=False, convert_to_numpy=True))]
 
-        self.docs = docs
-        # Compute embeddings
-        embs = self.model.encode(docs, show_progress_bar=False, convert_to_numpy=True)
-        self.embeddings = embs
-
-        # Build nearest-neighbors index
-        self.nn = NearestNeighbors(n_neighbors=min(5, len(docs)), metric='cosine')
-        self.nn.fit(embs)
+        self.passages = passages
+        self.docs = [p['text'] for p in passages]
+        # Compute embeddings (rows are unit length, so scoring is a plain matmul)
+        self.embeddings = None
+        if self.uses_dense:
+            self.embeddings = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        lexical = BM25Index.build(self.docs)
+        self.bm25 = lexical if self.uses_bm25 else None
+        self.ann = None
+        if self.uses_dense and want_ann(len(passages)):
+            self.ann = ann.IVFIndex.build(self.embeddings, ANN_LISTS or None, ANN_DTYPE)
 
         # Persist index
         try:
-            with open(INDEX_FILE, 'wb') as f:
-                pickle.dump({'docs': self.docs, 'embeddings': self.embeddings}, f)
-        except Exception:
-            pass
+            save_store(self.passages, self.embeddings, lexical, files, self.ann)
+        except Exception as e:
+            print(f"⚠️ Could not save RAG index: {e}")
 
+        self.last_build = {
+            'backend': self.backend,
+            'files_reused': reused,
+            'files_indexed': indexed,
+            'passages': len(passages),
+            'passages_embedded': embedded,
+            'ann_lists': self.ann.n_lists if self.ann is not None else 0,
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        print(f"📚 RAG index built: {self.last_build}")
         return True
 
     def load(self):
-        if not self.available():
-            return False
-
         # Try load from disk
-        if os.path.exists(INDEX_FILE):
-            try:
-                with open(INDEX_FILE, 'rb') as f:
-                    data = pickle.load(f)
-                    self.docs = data.get('docs', [])
-                    self.embeddings = data.get('embeddings', None)
-            except Exception:
-                self.docs = []
-                self.embeddings = None
-
-        # If embeddings not available, build from scratch
-        if not self.embeddings:
+        stored = load_store()
+        if stored is None:
+            # Missing or stale: build from scratch
             return self.build()
+        passages, embeddings, lexical, ann_index, manifest = stored
 
-        # Load model and nn
-        self.model = SentenceTransformer(MODEL_NAME)
-        self.nn = NearestNeighbors(n_neighbors=min(5, len(self.docs)), metric='cosine')
-        self.nn.fit(self.embeddings)
+        # Knowledge files added, removed or edited since the index was written
+        stored_hashes = {name: f['sha256'] for name, f in manifest.get('files', {}).items()}
+        current = _scan_knowledge(manifest.get('files', {}))
+        if {name: f['sha256'] for name, f in current.items()} != stored_hashes:
+            return self.build()
+        # Written by another backend / model: fill in what this one needs
+        if (self.uses_dense and embeddings is None) or (self.uses_bm25 and lexical is None):
+            return self.build()
+        use_ann = self.uses_dense and want_ann(len(passages))
+        if use_ann and (ann_index is None or ann_index.dtype != ANN_DTYPE
+                        or (ANN_LISTS and ann_index.n_lists != ANN_LISTS)):
+            return self.build()
+
+        self.passages = passages
+        self.docs = [p['text'] for p in passages]
+        self.embeddings = embeddings if self.uses_dense else None
+        self.bm25 = lexical if self.uses_bm25 else None
+        self.ann = ann_index if use_ann else None
+
+        # Load model (once)
+        if self.uses_dense and self.model is None:
+            self.model = SentenceTransformer(MODEL_NAME)
         return True
 
-    def retrieve(self, query: str, k: int = 3):
-        if not self.available():
-            return []
-        if not self.model or self.embeddings is None:
-            if not self.load():
-                return []
+    def encode_queries(self, queries: List[str]):
+        """
+        Unit-normalised embeddings for queries, one row each. Queries are
+        normalised first and looked up in the LRU, so only unseen ones go
+        through the model (in one batch).
+        """
+        keys = [normalise(q) for q in queries]
+        vectors = [self.query_cache.get(key) for key in keys]
+        missing = sorted({key for key, vec in zip(keys, vectors) if vec is None})
+        if missing:
+            embs = _unit_rows(self.model.encode(missing, convert_to_numpy=True, show_progress_bar=False))
+            fresh = dict(zip(missing, embs))
+            for key, vec in fresh.items():
+                self.query_cache.set(key, vec)
+            vectors = [fresh[key] if vec is None else vec for key, vec in zip(keys, vectors)]
+        return np.vstack(vectors)
 
-        q_emb = self.model.encode([query], convert_to_numpy=True)
-        distances, indices = self.nn.kneighbors(q_emb, n_neighbors=min(k, len(self.docs)))
+    def top_k(self, query_embs, k: int):
+        """
+        (indices, scores) of the k best passages per query row, best first.
+        One matmul against the unit-length passage matrix gives every cosine
+        score; argpartition picks the top k without sorting the whole row.
+        """
+        scores = query_embs @ self.embeddings.T
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (scores.shape[0], k))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embs, k: int):
+        """
+        [(row, cosine score)] per query row, best first. With an ANN index the
+        `ann_probes` nearest lists give k * ANN_RERANK candidates which are
+        re-scored exactly against the float32 embeddings; otherwise top_k().
+        """
+        if self.ann is None:
+            indices, scores = self.top_k(query_embs, k)
+            return [list(zip(row.tolist(), row_scores.tolist())) for row, row_scores in zip(indices, scores)]
         results = []
-        for idx in indices[0]:
-            results.append(self.docs[idx])
+        for query in query_embs:
+            rows, _ = self.ann.search(query, k * ANN_RERANK, self.ann_probes)
+            rows = np.sort(rows)   # ascending reads from the mmap
+            exact = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+            top = np.argsort(-exact)[:k]
+            results.append(list(zip(rows[top].tolist(), exact[top].tolist())))
         return results
 
+    def retrieve_many(self, queries: List[str], k: int = 3):
+        """
+        Top-k passages for each query. Returns one list per query of
+        {'text', 'source', 'chunk', 'score'}; score is the cosine similarity
+        (dense), BM25 score (bm25) or fused reciprocal-rank score (hybrid).
+        Dense queries are encoded in one batch and scored in one matmul.
+        """
+        if not queries:
+            return []
+        if not self.ready and not self.load():
+            return [[] for _ in queries]
+
+        if self.backend == 'bm25':
+            hits = [self.bm25.search(q, k) for q in queries]
+        else:
+            n = k if self.backend == 'dense' else max(k, HYBRID_CANDIDATES)
+            hits = self.search(self.encode_queries(queries), n)
+            if self.backend == 'hybrid':
+                hits = [_fuse([dense, self.bm25.search(q, HYBRID_CANDIDATES)], k)
+                        for q, dense in zip(queries, hits)]
+        return [[dict(self.passages[idx], score=float(score)) for idx, score in row] for row in hits]
+
+    def retrieve_passages(self, query: str, k: int = 3):
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve(self, query: str, k: int = 3):
+        return [p['text'] for p in self.retrieve_passages(query, k)]
+
 
 # Create a global index instance
 index = RAGIndex()
+_load_lock = threading.Lock()
+_failed_at = None
+_warmed = False
+RETRY_SECONDS = 60   # don't retry a failed load on every message
+WARMUP_ENABLED = os.getenv('RAG_WARMUP', 'true').lower() == 'true'
+
 
 def ensure_index():
-    try:
-        return index.load()
-    except Exception:
+    """
+    Load the index and model once per process. After that this is a flag
+    check; a failed load is retried at most every RETRY_SECONDS.
+    """
+    global _failed_at
+    if index.ready:
+        return True
+    with _load_lock:
+        if index.ready:
+            return True
+        if _failed_at is not None and time.monotonic() - _failed_at < RETRY_SECONDS:
+            return False
         try:
-            return index.build()
+            ok = index.load()
         except Exception:
-            return False
+            try:
+                ok = index.build()
+            except Exception as e:
+                print(f"⚠️ RAG index unavailable: {e}")
+                ok = False
+        _failed_at = None if ok else time.monotonic()
+        return ok
+
+
+def warmup(encode: bool = True):
+    """
+    Load the index and model now rather than on the first chat message.
+    encode=True also embeds a dummy query so lazy runtime init happens up
+    front; pass False in a process that will fork afterwards (gunicorn
+    preload_app master) and let each worker do that part after the fork.
+    Disabled with RAG_WARMUP=false (the index then loads on first use).
+    """
+    global _warmed
+    if _warmed or not WARMUP_ENABLED:
+        return _warmed
+    started = time.perf_counter()
+    ok = ensure_index()
+    if ok and encode:
+        try:
+            if index.uses_dense:
+                index.model.encode(['warmup'], convert_to_numpy=True, show_progress_bar=False)
+            _warmed = True
+        except Exception as e:
+            print(f"⚠️ RAG warmup query failed: {e}")
+    if ok:
+        print(f"🔥 RAG index ready ({index.backend}): {len(index.docs)} passages in {time.perf_counter() - started:.2f}s")
+    return ok
+
 
 def retrieve(query: str, k: int = 3):
     try:
@@ -133,3 +623,48 @@ def retrieve(query: str, k: int = 3):
         return index.retrieve(query, k)
     except Exception:
         return []
+
+
+def retrieve_passages(query: str, k: int = 3):
+    """Like retrieve(), but each hit is {'text', 'source', 'chunk', 'score'}"""
+    try:
+        ok = ensure_index()
+        if not ok:
+            return []
+        return index.retrieve_passages(query, k)
+    except Exception:
+        return []
+
+
+def retrieve_many(queries: List[str], k: int = 3):
+    """Batch retrieve_passages() for offline jobs (FAQ pre-answering, re-ranking)"""
+    queries = list(queries)
+    try:
+        ok = ensure_index()
+        if not ok:
+            return [[] for _ in queries]
+        return index.retrieve_many(queries, k)
+    except Exception:
+        return [[] for _ in queries]
+
+
+def embed(texts):
+    """
+    Unit-normalised embeddings for texts using the shared index model,
+    or None when the backend doesn't use one (bm25).
+    """
+    try:
+        if not index.uses_dense:
+            return None
+        if index.model is None and not ensure_index():
+            return None
+        # Shares the query LRU with retrieve(): the answer cache and retrieval
+        # embed the same question once between them
+        return index.encode_queries(list(texts))
+    except Exception:
+        return None
+
+
+if __name__ == '__main__':
+    # python rag.py   -> refresh the on-disk index (only changed files are re-embedded)
+    sys.exit(0 if index.build() else 1)
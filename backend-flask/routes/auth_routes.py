@@ -4,11 +4,90 @@ from functools import wraps
 import jwt, datetime
 from models import db, User
 import re
+import os
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
+from cache import TTLCache
+import token_versions
 
 auth_bp = Blueprint("auth_bp", __name__, url_prefix="/auth")
 
+# ✅ Authenticated-user cache: skips the users-table round trip for the burst
+# of requests a screen load makes. The cache is per process, so each entry is
+# stored with the user's token version: deactivation, reactivation, role and
+# password changes and deletes bump that version, and the other workers drop
+# their snapshot as soon as their token_versions map (refreshed every
+# TOKEN_VERSION_REFRESH seconds) sees the bump. Other edits (name, phone)
+# show up once the entry is USER_CACHE_TTL seconds old.
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "300"))
+)
+
+
+class CachedUser:
+    """Read-only snapshot of a User row, safe to share across requests"""
+    __slots__ = ("id", "name", "email", "role", "phone", "is_active", "created_at")
+
+    def __init__(self, user):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+
+def load_current_user(user_id):
+    """User snapshot for user_id, re-read after a token version bump (None if gone)"""
+    version = token_versions.current(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    snapshot = CachedUser(user)
+    user_cache.set(user_id, (version, snapshot))
+    return snapshot
+
+
+def invalidate_user(user_id):
+    """Call after committing a change to the user (and any token_versions.bump)"""
+    user_cache.pop(user_id)
+    token_versions.reload(user_id)
+
+
+# ✅ Claims-only auth: when enabled, tokens carrying role/is_active/ver claims
+# are authorised without touching the users table. Revocation goes through
+# token_versions (bumped on deactivate, role/password change and delete).
+CLAIMS_AUTH = os.getenv("JWT_CLAIMS_AUTH", "false").lower() in ("1", "true", "yes")
+
+
+class ClaimsUser:
+    """current_user built from JWT claims alone (only id/email/role/is_active)"""
+    __slots__ = ("id", "name", "email", "role", "phone", "is_active", "created_at")
+
+    def __init__(self, data):
+        self.id = data["id"]
+        self.email = data.get("email")
+        self.role = data.get("role")
+        self.is_active = bool(data.get("is_active"))
+        self.name = self.phone = self.created_at = None
+
+
+def resolve_current_user(data):
+    """Returns (current_user, None) or (None, error response) for decoded token data"""
+    if "ver" in data and not token_versions.is_current(data["id"], data["ver"]):
+        return None, (jsonify({'error': 'Token revoked! Please login again.'}), 401)
+
+    if CLAIMS_AUTH and "ver" in data and "is_active" in data:
+        current_user = ClaimsUser(data)
+    else:
+        current_user = load_current_user(data['id'])
+        if not current_user:
+            return None, (jsonify({'error': 'User not found!'}), 404)
+
+    if not current_user.is_active:
+        return None, (jsonify({'error': 'Your account is not active.', 'is_active': False}), 403)
+    return current_user, None
+
 # ✅ Register Route - ADMIN ONLY
 @auth_bp.route("/register", methods=["POST"])
 def register():
@@ -112,7 +191,10 @@ def login():
     token = jwt.encode(
         {
             "id": user.id,
+            "email": user.email,
             "role": user.role,
+            "is_active": bool(user.is_active),
+            "ver": token_versions.version_for_login(user.id),
             "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=12),
         },
         SECRET_KEY,
@@ -148,9 +230,9 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            current_user = User.query.get(data['id'])
-            if not current_user:
-                return jsonify({'error': 'User not found!'}), 404
+            current_user, error = resolve_current_user(data)
+            if error:
+                return error
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token expired!'}), 401
         except jwt.InvalidTokenError:
@@ -176,9 +258,9 @@ def admin_required(f):
 
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            current_user = User.query.get(data['id'])
-            if not current_user:
-                return jsonify({'error': 'User not found!'}), 404
+            current_user, error = resolve_current_user(data)
+            if error:
+                return error
             
             # ✅ CHECK IF USER IS ADMIN
             if current_user.role != 'admin':
@@ -197,6 +279,8 @@ def admin_required(f):
 @auth_bp.route("/profile", methods=["GET"])
 @token_required
 def profile(current_user):
+    # Claims-authenticated users carry no name; fetch the full record
+    current_user = load_current_user(current_user.id) or current_user
     return jsonify({
         "id": current_user.id,
         "name": current_user.name,
@@ -328,6 +412,7 @@ def update_user(current_user, user_id):
     if other_phone:
         return jsonify({"error": "Phone already used by another user"}), 400
 
+    revoke = role != user.role or bool(password)
     user.name = name
     user.email = email
     user.phone = phone
@@ -336,7 +421,10 @@ def update_user(current_user, user_id):
     if password:
         user.password = generate_password_hash(password)
 
+    if revoke:
+        token_versions.bump(user.id)
     db.session.commit()
+    invalidate_user(user.id)
     return jsonify({"message": "User updated"}), 200
 
 
@@ -352,7 +440,9 @@ def delete_user(current_user, user_id):
             return jsonify({"error": "User not found"}), 404
         
         db.session.delete(user)
+        token_versions.bump(user_id)
         db.session.commit()
+        invalidate_user(user_id)
         
         print(f"✅ User {user_id} deleted successfully by admin {current_user.id}")
         return jsonify({"message": "User deleted successfully ✅"}), 200
@@ -377,31 +467,49 @@ def toggle_user(current_user, user_id):
     if not user:
         return jsonify({"error": "User not found"}), 404
     user.is_active = not bool(user.is_active)
+    # Bump on reactivation too, so other workers drop the inactive snapshot
+    # (an inactive user can't log in, so no live token is revoked by it)
+    token_versions.bump(user.id)
     db.session.commit()
+    invalidate_user(user.id)
     return jsonify({"message": "Status updated", "is_active": bool(user.is_active)}), 200
 # ---------------------------------------------------------------------------------------
 
 @auth_bp.route("/update-profile", methods=["PUT"])
 @token_required
 def update_profile(current_user):
+    # current_user is a cached snapshot; load the row we are about to write
+    user = User.query.get(current_user.id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
     data = request.get_json() or {}
-    name = data.get("name", current_user.name).strip()
-    phone = data.get("phone", current_user.phone).strip()
+    name = data.get("name", user.name).strip()
+    phone = data.get("phone", user.phone).strip()
     password = data.get("password")
 
     # check duplicates
-    other_phone = User.query.filter(User.phone == phone, User.id != current_user.id).first()
+    other_phone = User.query.filter(User.phone == phone, User.id != user.id).first()
     if other_phone:
         return jsonify({"error": "Phone number already used"}), 400
 
-    current_user.name = name
-    current_user.phone = phone
+    user.name = name
+    user.phone = phone
     if password:
-        current_user.password = generate_password_hash(password)
+        user.password = generate_password_hash(password)
 
+    if password:
+        token_versions.bump(user.id)
     db.session.commit()
+    invalidate_user(user.id)
     return jsonify({"message": "Profile updated successfully ✅"}), 200
 
+# ✅ Auth cache hit/miss counters (per worker process)
+@auth_bp.route("/cache-stats", methods=["GET"])
+@admin_required
+def cache_stats(current_user):
+    return jsonify({"user_cache": user_cache.stats()}), 200
+
 # ✅ Fetch single user details by ID
 @auth_bp.route("/user/<int:user_id>", methods=["GET"])
 def get_user_by_id(user_id):
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
 # Optional RAG retrieval (lightweight). If packages are not installed, retrieval becomes a no-op.
 try:
     from .. import rag as rag_module
@@ -8,399 +8,481 @@ except Exception:
     except Exception:
         rag_module = None  # RAG not available, will skip retrieval
 import google.generativeai as genai
-from gtts import gTTS
 import os
 from dotenv import load_dotenv
-import base64
-from PIL import Image
-import io
+import json
+import time
+from session_store import create_session_store
+import voice_jobs
+import answer_cache
+import gemini_client
+import images
+import uploads
+import speech
+import prompt_builder
 
 chatbot_bp = Blueprint("chatbot_bp", __name__)
 
 # Load .env file
 load_dotenv()
 
-# Get Gemini API key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("⚠️ WARNING: GEMINI_API_KEY not found in environment variables!")
-    print(f"Current working directory: {os.getcwd()}")
-    print(f".env file exists: {os.path.exists('.env')}")
-    raise ValueError("GEMINI_API_KEY not found in .env file. Please check your .env file in backend-flask directory.")
+# Gemini key/model are resolved lazily on first chat request (see gemini_client),
+# so a missing key or slow model listing never blocks app startup
+if not gemini_client.api_key():
+    print("⚠️ WARNING: GEMINI_API_KEY not found in environment variables! Chat routes will return fallback replies.")
 
-print(f"✅ Gemini API key loaded successfully (length: {len(GEMINI_API_KEY)})")
-genai.configure(api_key=GEMINI_API_KEY)
+# Conversation history per session (bounded, shared across workers by default)
+session_store = create_session_store()
 
-# Store conversation history per session
-conversation_sessions = {}
+# Replies to similar first-turn questions, keyed by language + question embedding
+reply_cache = answer_cache.SemanticAnswerCache(
+    embed=getattr(rag_module, "embed", None) if rag_module else None
+)
 
-# List available models to find the correct one
-MODEL_NAME = None
-available_models_list = []
-
-try:
-    models = genai.list_models()
-    available_models_list = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
-    print(f"📋 Available models with generateContent: {available_models_list}")
-    
-    # Try common model names in order of preference (including vision models)
-    # Use gemini-2 models first as they're more capable
-    preferred_models = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash", "models/gemini-2.5-flash", "models/gemini-2.0-flash", "models/gemini-1.5-pro", "models/gemini-1.5-flash"]
-    
-    # Check if any preferred model is available
-    for pref_model in preferred_models:
-        for avail_model in available_models_list:
-            if pref_model in avail_model or avail_model.endswith(pref_model.split('/')[-1]):
-                MODEL_NAME = avail_model.split('/')[-1]  # Get model name without 'models/' prefix
-                print(f"✅ Found preferred model: {MODEL_NAME}")
-                break
-        if MODEL_NAME:
-            break
-    
-    # If no preferred model found, use the first available
-    if not MODEL_NAME and available_models_list:
-        MODEL_NAME = available_models_list[0].split('/')[-1]
-        print(f"✅ Using first available model: {MODEL_NAME}")
-    elif not MODEL_NAME:
-        MODEL_NAME = "gemini-1.5-flash"  # Final fallback (supports vision)
-        print(f"⚠️ Using default fallback model: {MODEL_NAME}")
-        
-except Exception as e:
-    print(f"⚠️ Could not list models: {e}")
-    # Try common model names as fallback
-    MODEL_NAME = "gemini-1.5-flash"  # Default fallback (supports vision)
-    print(f"⚠️ Using default model: {MODEL_NAME}")
-
-print(f"🤖 Using model: {MODEL_NAME}")
 
 # Ensure static directory exists for voice files
 STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
 os.makedirs(STATIC_DIR, exist_ok=True)
 
-def _format_history(history):
-    """Format conversation history for context"""
-    if not history:
-        return "(This is the start of the conversation)"
-    
-    formatted = []
-    for msg in history[-6:]:  # Last 6 messages (3 exchanges)
-        formatted.append(f"{msg['role'].upper()}: {msg['content'][:200]}")
-    return "\n".join(formatted)
-
-@chatbot_bp.route("/chatbot", methods=["POST"])
-def chatbot_reply():
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided", "reply": "I need a message to help you. Please ask me anything about dairy management!"}), 400
-            
-        user_input = data.get("message", "").strip()
-        language = data.get("language", "en")  # Language code: en, kn, hi, etc.
-        session_id = data.get("session_id", "default")  # Session ID for conversation history
-        image_data = data.get("image", None)  # Base64 encoded image
-        
-        if not user_input and not image_data:
-            return jsonify({"error": "No message provided", "reply": "Please type or speak your question and I'll be happy to help!"}), 400
-
-        force_language = data.get("force_language", False)
-        print(f"📩 Received: {user_input[:50] if user_input else 'IMAGE ONLY'}... | Lang: {language} | Force: {force_language} | Session: {session_id} | Image: {'YES' if image_data else 'NO'}")
+# Map language codes to names
+LANG_NAMES = {
+    "en": "English",
+    "kn": "Kannada (ಕನ್ನಡ)",
+    "hi": "Hindi (हिंदी)",
+    "te": "Telugu (తెలుగు)",
+    "ta": "Tamil (தமிழ்)",
+    "mr": "Marathi (मराठी)"
+}
+
+# Only block truly harmful content, NOT dairy/veterinary topics
+HARMFUL_KEYWORDS = ["suicide", "self-harm", "kill myself", "end my life", "hurt others", "illegal drugs", "weapon", "bomb"]
+
+# Configure generation for sharp, intelligent responses
+GENERATION_CONFIG = {
+    "temperature": 0.6,  # balanced creativity (avoid hallucination)
+    "top_p": 0.9,
+    "top_k": 40,
+    "max_output_tokens": 1800,  # allow longer detailed responses
+}
+
+# Relaxed safety - allow veterinary/medical dairy content
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+]
+
+
+def _prepare_chat(data):
+    """
+    Validate a chat request and build the Gemini prompt.
+    Returns (chat, None) where chat holds everything needed to generate and
+    finish the reply, or (None, response) when the request is answered early.
+    """
+    if not data:
+        return None, (jsonify({"error": "No data provided", "reply": "I need a message to help you. Please ask me anything about dairy management!"}), 400)
+
+    user_input = data.get("message", "").strip()
+    language = data.get("language", "en")  # Language code: en, kn, hi, etc.
+    session_id = data.get("session_id", "default")  # Session ID for conversation history
+    image_data = data.get("image", None)  # Base64 encoded image, or an uploaded file (see uploads.py)
+
+    if not user_input and not image_data:
+        return None, (jsonify({"error": "No message provided", "reply": "Please type or speak your question and I'll be happy to help!"}), 400)
+
+    force_language = data.get("force_language", False)
+    print(f"📩 Received: {user_input[:50] if user_input else 'IMAGE ONLY'}... | Lang: {language} | Force: {force_language} | Session: {session_id} | Image: {'YES' if image_data else 'NO'}")
+
+    user_input_lower = user_input.lower() if user_input else ""
+
+    # Check for harmful content ONLY
+    if any(keyword in user_input_lower for keyword in HARMFUL_KEYWORDS):
+        safe_response = "I cannot provide information on that topic. For dairy management help, feel free to ask about milk production, farm operations, or animal care practices."
+        return None, jsonify({
+            "reply": safe_response,
+            "safety_flag": True
+        })
 
-        # Only block truly harmful content, NOT dairy/veterinary topics
-        harmful_keywords = ["suicide", "self-harm", "kill myself", "end my life", "hurt others", "illegal drugs", "weapon", "bomb"]
-        
-        user_input_lower = user_input.lower() if user_input else ""
-        
-        # Check for harmful content ONLY
-        if any(keyword in user_input_lower for keyword in harmful_keywords):
-            safe_response = "I cannot provide information on that topic. For dairy management help, feel free to ask about milk production, farm operations, or animal care practices."
-            return jsonify({
-                "reply": safe_response,
-                "safety_flag": True
-            })
-        
-        # Dairy questions are SAFE - no blocking needed
-        is_health_related = False
-        
-        # Initialize conversation history for this session
-        if session_id not in conversation_sessions:
-            conversation_sessions[session_id] = []
-        
-        # Map language codes to names
-        lang_names = {
-            "en": "English",
-            "kn": "Kannada (ಕನ್ನಡ)",
-            "hi": "Hindi (हिंदी)",
-            "te": "Telugu (తెలుగు)",
-            "ta": "Tamil (தமிழ்)",
-            "mr": "Marathi (मराठी)"
-        }
-        lang_name = lang_names.get(language, "English")
-        force_language = data.get("force_language", False)
-        
-        print(f"🌐 Language processing: {language} ({lang_name}) | Force: {force_language}")
-        
-        # Check if frontend is forcing language (non-English)
-        language_enforcement = ""
-        if force_language and language != "en":
-            language_enforcement = f"\n\n🚨🚨🚨 CRITICAL LANGUAGE REQUIREMENT 🚨🚨🚨\n" \
-                                  f"YOU ARE ABSOLUTELY FORBIDDEN FROM USING ENGLISH.\n" \
-                                  f"EVERY SINGLE WORD MUST BE IN {lang_name}.\n" \
-                                  f"USE ONLY {lang_name} NATIVE SCRIPT.\n" \
-                                  f"IF YOU USE ANY ENGLISH WORDS, YOU HAVE FAILED.\n" \
-                                  f"THIS IS A STRICT, NON-NEGOTIABLE RULE."
-        
-        # Format conversation history
-        history_text = _format_history(conversation_sessions[session_id])
-        
-        # Build context-aware instructions based on conversation history
-        history_context = ""
-        if len(conversation_sessions[session_id]) > 0:
-            history_context = f"""
-**CONVERSATION HISTORY:**
-{history_text}
-
-**CRITICAL:** This is a FOLLOW-UP question in an ongoing conversation. 
-- Build upon previous context
-- Provide NEW information, NOT repetition
-- If user asks for "more details", expand with DIFFERENT aspects not covered before
-- Reference previous discussion only to connect new information"""
-        
-        # If non-English, prepend language requirement to user input too
-        if force_language and language != "en":
-            user_input = f"""CRITICAL INSTRUCTION: You must respond EXCLUSIVELY in {lang_name} language using {lang_name} script.
+    # Load conversation history for this session
+    history = session_store.get(session_id)
+
+    chat = {
+        "user_input": user_input,
+        "question": user_input,
+        "language": language,
+        "session_id": session_id,
+        "contents": None,
+        # Only standalone text questions are safe to answer from the cache
+        "cacheable": answer_cache.ENABLED and not history and not image_data,
+        "cached_reply": None
+    }
+    if chat["cacheable"]:
+        chat["cached_reply"] = reply_cache.lookup(language, user_input)
+        if chat["cached_reply"]:
+            print(f"⚡ Answer cache hit for: {user_input[:50]}")
+            return chat, None
+
+    lang_name = LANG_NAMES.get(language, "English")
+
+    print(f"🌐 Language processing: {language} ({lang_name}) | Force: {force_language}")
+
+    # If non-English, prepend language requirement to user input too
+    if force_language and language != "en":
+        user_input = f"""CRITICAL INSTRUCTION: You must respond EXCLUSIVELY in {lang_name} language using {lang_name} script.
 DO NOT use English. DO NOT mix languages. ONLY {lang_name}.
 
 User's question:
 {user_input}"""
-        
-        # Concise prompt - focuses on answering the SPECIFIC question asked
-        if language != "en":
-            system_prompt = f"""You are a dairy farming AI assistant.
+
+    # Concise prompt - focuses on answering the SPECIFIC question asked
+    if language != "en":
+        system_prompt = f"""You are a dairy farming AI assistant.
 
 ABSOLUTE RULE: Respond ONLY in {lang_name}. Zero English words allowed. Use {lang_name} script exclusively.
 
 **Expertise:** Cattle breeds, health, milk production, diseases, breeding, farm management.
 **Style:** Concise, direct answers.
 
-{history_context}
-
 **Critical Instructions:**
 - Answer the SPECIFIC question asked
 - Provide NEW information, not repetition
 - Use numbered steps for complex topics"""
-        else:
-            system_prompt = f"""You are a dairy farming AI assistant. Respond in English.
+    else:
+        system_prompt = f"""You are a dairy farming AI assistant. Respond in English.
 
 **Expertise:** Cattle breeds, health, milk production, diseases, breeding, farm management.
 **Style:** Concise, direct answers.
 
-{history_context}
-
 **Critical Instructions:**
 - Answer the SPECIFIC question asked
 - Provide NEW information, not repetition
 - For IMAGE uploads: Identify animal, assess condition, diagnose issues, suggest actions"""
 
-        # No blocking - answer everything related to dairy farming
-
-        # Process image if provided
-        image_content = None
-        if image_data:
-            try:
-                # Remove data URL prefix if present
-                if "base64," in image_data:
-                    image_data = image_data.split("base64,")[1]
-                
-                # Decode base64 image
-                image_bytes = base64.b64decode(image_data)
-                image_content = {
-                    'mime_type': 'image/jpeg',
-                    'data': image_bytes
-                }
-                print(f"🖼️ Image decoded successfully: {len(image_bytes)} bytes")
-                
-                # Add image analysis prompt
-                if user_input:
-                    user_input = f"[User attached an image]\n{user_input}\n\nPlease analyze the image and answer the question."
-                else:
-                    user_input = "Please analyze this image of the animal and provide detailed observations about its health, breed, condition, and any visible issues or concerns."
-                    
-            except Exception as img_error:
-                print(f"❌ Image decode error: {img_error}")
-                image_content = None
-        
-        # Call Gemini API with enhanced safety settings
-        model = genai.GenerativeModel(MODEL_NAME)
-        
-        # Configure generation for sharp, intelligent responses
-        generation_config = {
-            "temperature": 0.6,  # balanced creativity (avoid hallucination)
-            "top_p": 0.9,
-            "top_k": 40,
-            "max_output_tokens": 1800,  # allow longer detailed responses
-        }
-        
-        # Relaxed safety - allow veterinary/medical dairy content
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-        ]
-        
-        # Retrieve supporting docs (RAG) if available and add as context
-        retrieved = []
+    # Process image if provided
+    image_content = None
+    if image_data:
         try:
-            if rag_module and hasattr(rag_module, 'retrieve'):
-                retrieved = rag_module.retrieve(user_input, k=3)
-        except Exception as e:
-            print(f"⚠️ RAG retrieval failed: {e}")
+            # Decode, then rotate / downscale / recompress before uploading to Gemini
+            image_bytes, mime_type, info = images.normalise(uploads.media_stream(image_data))
+            image_content = {
+                'mime_type': mime_type,
+                'data': image_bytes
+            }
+            print(f"🖼️ Image normalised: {info['source_format']} {info['source_bytes']} bytes -> "
+                  f"{mime_type} {info['size'][0]}x{info['size'][1]} {info['bytes']} bytes (q={info['quality']})")
+
+            # Add image analysis prompt
+            if user_input:
+                user_input = f"[User attached an image]\n{user_input}\n\nPlease analyze the image and answer the question."
+            else:
+                user_input = "Please analyze this image of the animal and provide detailed observations about its health, breed, condition, and any visible issues or concerns."
 
-        context_block = ""
-        if retrieved:
-            context_block = "\n\n---\nRelevant documents for context:\n" + "\n---\n".join([f"- {d[:500]}" for d in retrieved]) + "\n\n"
+        except images.ImageRejected as img_error:
+            print(f"❌ Image rejected: {img_error}")
+            return None, (jsonify({"error": "Invalid image", "reply": str(img_error)}), 400)
+        except Exception as img_error:
+            print(f"❌ Image decode error: {img_error}")
+            image_content = None
 
-        # Generate response with context awareness - emphasize user's specific question
-        if context_block:
-            full_prompt = f"{system_prompt}\n\n**Reference Documents:**\n{context_block}\n\n**User Question:** {user_input}\n\n**Your Response (in {lang_name}):**"
-        else:
-            full_prompt = f"{system_prompt}\n\n**User Question:** {user_input}\n\n**Your Response (in {lang_name}):**"
-        
+    # Retrieve supporting passages (RAG) if available and add as context
+    retrieved = []
+    try:
+        if rag_module and hasattr(rag_module, 'retrieve_passages'):
+            # Embed the user's own question, not the language/image preamble around it
+            retrieved = rag_module.retrieve_passages(chat["question"] or user_input, k=3)
+    except Exception as e:
+        print(f"⚠️ RAG retrieval failed: {e}")
+
+    # Assemble under the token budget: question first, then passages, then history
+    full_prompt, prompt_stats = prompt_builder.build(
+        system_prompt, user_input, lang_name,
+        passages=retrieved, history=history, has_image=image_content is not None
+    )
+    print(f"🧮 Prompt: ~{prompt_stats['tokens']}/{prompt_stats['budget']} tokens | "
+          f"passages {prompt_stats['passages']} (+{prompt_stats['passages_dropped']} dropped) | "
+          f"history {prompt_stats['history_verbatim']} verbatim, {prompt_stats['history_summarised']} summarised, "
+          f"{prompt_stats['history_dropped']} dropped")
+
+    # Prepare content for API
+    if image_content:
+        # Use vision model with image
+        contents = [image_content, full_prompt]
+        print("🖼️ Generating response with image analysis...")
+    else:
+        # Text only
+        contents = full_prompt
+
+    chat["user_input"] = user_input
+    chat["contents"] = contents
+    return chat, None
+
+
+def _reply_from_response(response):
+    """
+    (reply text, True) from a Gemini response, or (fallback text, False)
+    when it was blocked or empty
+    """
+    # Check if response was blocked
+    if response and hasattr(response, 'text') and response.text and len(response.text.strip()) > 0:
+        return response.text, True
+    elif response and hasattr(response, 'prompt_feedback'):
+        print(f"⚠️ Response blocked - prompt feedback: {response.prompt_feedback}")
+        return f"As a dairy expert, I can help with that! Could you provide more specific details about your situation? This will help me give you the most accurate advice.", False
+    else:
+        print(f"⚠️ Empty response received")
+        return f"I'm your dairy farming expert! Please rephrase your question and I'll help with specific advice about milk production, animal health, feed, diseases, or any dairy topic. Ask me anything!", False
+
+
+def _cache_reply(chat, bot_text):
+    """Remember a genuine model answer for similar future questions"""
+    if chat["cacheable"] and bot_text and len(bot_text) <= 2000:
+        reply_cache.store(chat["language"], chat["question"], bot_text)
+
+
+def _reply_for_error(gen_error):
+    """Helpful fallback reply when generation fails"""
+    print(f"❌ Generation error: {gen_error}")
+    print(f"❌ Full error details: {type(gen_error).__name__}: {str(gen_error)}")
+    error_msg = str(gen_error).lower()
+
+    if "quota" in error_msg or "rate" in error_msg or "429" in error_msg:
+        # Rate limit exceeded - provide helpful fallback with actual answer
+        return f"I'm experiencing high demand right now 🕐. Here's a quick answer:\n\nTo increase milk yield:\n\n1. **Nutrition** 🌾: Provide balanced feed with 16-18% protein, minerals\n2. **Water** 💧: 60-80 liters/cow/day\n3. **Comfort** 🛏️: Clean, dry bedding, proper ventilation\n4. **Health** 💉: Regular vet checks, vaccinations\n5. **Milking** 🥛: 2-3 times daily, gentle handling\n\nPlease try again in a minute for detailed advice!"
+    elif "block" in error_msg or "safety" in error_msg:
+        # Content was blocked - answer it anyway for dairy topics
+        return f"As a dairy expert, I can help with that! Could you provide more specific details about your situation (number of animals, symptoms, current practices)? This will help me give you the most accurate advice."
+    else:
+        return f"I'm here to help with dairy farming! Please ask about: milk production 🥛, animal diseases 🏥, feed nutrition 🌾, breeding 🐄, or farm management 📊. What would you like to know?"
+
+
+def _finish_reply(chat, bot_text):
+    """Save the exchange to history, queue TTS and build the response payload"""
+    language = chat["language"]
+    session_id = chat["session_id"]
+
+    # Ensure response is never empty
+    if not bot_text or len(bot_text.strip()) == 0:
+        bot_text = "I'm your dairy management assistant! I can help you with milk production, farm operations, animal care, business management, and more. What would you like to know?"
+
+    # Truncate if too long
+    if len(bot_text) > 2000:
+        bot_text = bot_text[:2000] + "... Would you like me to continue with more details?"
+
+    # Save to conversation history (store keeps only the last 20 messages)
+    conversation_length = session_store.append(session_id, [
+        {"role": "user", "content": chat["user_input"]},
+        {"role": "assistant", "content": bot_text}
+    ])
+
+    print(f"✅ Bot reply generated: {len(bot_text)} characters | History: {conversation_length} messages")
+
+    # Queue text-to-speech in the background; the client polls voice_url
+    # (202 until the audio is ready). Each job gets its own file, so
+    # concurrent replies in one session no longer overwrite each other.
+    voice_job_id = None
+    try:
+        # Normalize language code (support 'kn-IN' -> 'kn') for gTTS
+        lang_short = language.split('-')[0] if isinstance(language, str) and '-' in language else language
+        tts_lang = lang_short if lang_short in ["en", "hi", "te", "ta", "mr", "kn"] else "en"
+        voice_job_id = voice_jobs.submit(bot_text, tts_lang)
+        if not voice_job_id:
+            print("⚠️ TTS queue full (continuing without voice)")
+    except Exception as tts_error:
+        print(f"⚠️ TTS error (continuing without voice): {tts_error}")
+
+    # Build a host-aware voice URL so mobile clients can reach it (don't hardcode 127.0.0.1)
+    voice_url = None
+    if voice_job_id:
+        base = request.host_url.rstrip('/')
+        voice_url = f"{base}/chat/voice/{voice_job_id}"
+
+    return {
+        "reply": bot_text,
+        "voice_url": voice_url,
+        "voice_job_id": voice_job_id,
+        "language": language,
+        "session_id": session_id,
+        "conversation_length": conversation_length,
+        "safety_checked": True
+    }
+
+
+def _error_reply(e):
+    """(payload, status) for an unexpected failure - always a helpful reply"""
+    error_msg = str(e)
+    print(f"Chatbot error: {error_msg}")
+
+    # Always return a helpful response, even on error
+    fallback_response = "I'm having trouble processing that right now, but I'm here to help! Please ask me about dairy farm management, milk production, animal care, or farm business operations. I'll do my best to assist you!"
+
+    # Provide more specific error messages
+    if "api_key" in error_msg.lower() or "authentication" in error_msg.lower():
+        return {
+            "error": "API configuration issue",
+            "reply": fallback_response
+        }, 200  # Return 200 so frontend gets the fallback message
+    elif "quota" in error_msg.lower() or "limit" in error_msg.lower():
+        return {
+            "error": "Service temporarily unavailable",
+            "reply": "I've reached my temporary limit. Please try again in a moment, and I'll be happy to help with your dairy management questions!"
+        }, 200
+    else:
+        return {
+            "error": "Processing error",
+            "reply": fallback_response
+        }, 200
+
+
+def _read_chat_request():
+    """(data, None), or (None, response) for an upload over the size limit"""
+    try:
+        return uploads.read_request(request, "image", "image/"), None
+    except uploads.UploadTooLarge as e:
+        return None, (jsonify({"error": str(e), "reply": "That photo is too large. Please send a smaller one."}), 413)
+
+
+def _prepare_chat_request():
+    """_prepare_chat() for a JSON, multipart or raw image request; the upload is closed afterwards"""
+    data, early_response = _read_chat_request()
+    if early_response:
+        return None, early_response
+    try:
+        return _prepare_chat(data)
+    finally:
+        uploads.close(data, "image")
+
+
+# Accepts the JSON body, multipart/form-data with an "image" file part, or a
+# raw image/* body with the other fields in the query string (see uploads.py)
+@chatbot_bp.route("/chatbot", methods=["POST"])
+def chatbot_reply():
+    try:
+        chat, early_response = _prepare_chat_request()
+        if early_response:
+            return early_response
+
+        if chat["cached_reply"]:
+            return jsonify(_finish_reply(chat, chat["cached_reply"]))
+
+        # Call Gemini API with enhanced safety settings
+        model = gemini_client.get_model()
         try:
-            # Prepare content for API
-            if image_content:
-                # Use vision model with image
-                contents = [image_content, full_prompt]
-                print("🖼️ Generating response with image analysis...")
-            else:
-                # Text only
-                contents = full_prompt
-            
             response = model.generate_content(
-                contents,
-                generation_config=generation_config,
-                safety_settings=safety_settings
+                chat["contents"],
+                generation_config=GENERATION_CONFIG,
+                safety_settings=SAFETY_SETTINGS
             )
-            
-            # Check if response was blocked
-            if response and hasattr(response, 'text') and response.text and len(response.text.strip()) > 0:
-                bot_text = response.text
-            elif response and hasattr(response, 'prompt_feedback'):
-                print(f"⚠️ Response blocked - prompt feedback: {response.prompt_feedback}")
-                bot_text = f"As a dairy expert, I can help with that! Could you provide more specific details about your situation? This will help me give you the most accurate advice."
-            else:
-                print(f"⚠️ Empty response received")
-                bot_text = f"I'm your dairy farming expert! Please rephrase your question and I'll help with specific advice about milk production, animal health, feed, diseases, or any dairy topic. Ask me anything!"
-                
+            bot_text, from_model = _reply_from_response(response)
+            if from_model:
+                _cache_reply(chat, bot_text)
         except Exception as gen_error:
             # Handle generation errors gracefully
-            print(f"❌ Generation error: {gen_error}")
-            print(f"❌ Full error details: {type(gen_error).__name__}: {str(gen_error)}")
-            error_msg = str(gen_error).lower()
-            
-            if "quota" in error_msg or "rate" in error_msg or "429" in error_msg:
-                # Rate limit exceeded - provide helpful fallback with actual answer
-                bot_text = f"I'm experiencing high demand right now 🕐. Here's a quick answer:\n\nTo increase milk yield:\n\n1. **Nutrition** 🌾: Provide balanced feed with 16-18% protein, minerals\n2. **Water** 💧: 60-80 liters/cow/day\n3. **Comfort** 🛏️: Clean, dry bedding, proper ventilation\n4. **Health** 💉: Regular vet checks, vaccinations\n5. **Milking** 🥛: 2-3 times daily, gentle handling\n\nPlease try again in a minute for detailed advice!"
-            elif "block" in error_msg or "safety" in error_msg:
-                # Content was blocked - answer it anyway for dairy topics
-                bot_text = f"As a dairy expert, I can help with that! Could you provide more specific details about your situation (number of animals, symptoms, current practices)? This will help me give you the most accurate advice."
-            else:
-                bot_text = f"I'm here to help with dairy farming! Please ask about: milk production 🥛, animal diseases 🏥, feed nutrition 🌾, breeding 🐄, or farm management 📊. What would you like to know?"
-        
-        # Ensure response is never empty
-        if not bot_text or len(bot_text.strip()) == 0:
-            bot_text = "I'm your dairy management assistant! I can help you with milk production, farm operations, animal care, business management, and more. What would you like to know?"
-        
-        # Truncate if too long
-        if len(bot_text) > 2000:
-            bot_text = bot_text[:2000] + "... Would you like me to continue with more details?"
-        
-        # Save to conversation history
-        conversation_sessions[session_id].append({"role": "user", "content": user_input})
-        conversation_sessions[session_id].append({"role": "assistant", "content": bot_text})
-        
-        # Keep only last 20 messages (10 exchanges)
-        if len(conversation_sessions[session_id]) > 20:
-            conversation_sessions[session_id] = conversation_sessions[session_id][-20:]
-        
-        print(f"✅ Bot reply generated: {len(bot_text)} characters | History: {len(conversation_sessions[session_id])} messages")
+            bot_text = _reply_for_error(gen_error)
 
-        # Convert text to speech with language support. Save voice file under static and return a URL reachable from client.
-        voice_filename = f"voice_response_{session_id}.mp3"
-        voice_path = None
-        try:
-            voice_path = os.path.join(STATIC_DIR, voice_filename)
+        return jsonify(_finish_reply(chat, bot_text))
 
-            # Normalize language code (support 'kn-IN' -> 'kn') for gTTS
-            lang_short = language.split('-')[0] if isinstance(language, str) and '-' in language else language
-            tts_lang = lang_short if lang_short in ["en", "hi", "te", "ta", "mr", "kn"] else "en"
+    except Exception as e:
+        payload, status = _error_reply(e)
+        return jsonify(payload), status
 
-            tts = gTTS(text=bot_text, lang=tts_lang, slow=False)
-            tts.save(voice_path)
-            print(f"🔊 Voice file saved: {voice_path} (Language: {tts_lang})")
-        except Exception as tts_error:
-            print(f"⚠️ TTS error (continuing without voice): {tts_error}")
-            voice_path = None
 
-        # Build a host-aware voice URL so mobile clients can reach it (don't hardcode 127.0.0.1)
-        voice_url = None
-        try:
-            if voice_path and os.path.exists(voice_path):
-                base = request.host_url.rstrip('/')
-                voice_url = f"{base}/chat/voice/{voice_filename}"
-        except Exception as e:
-            print(f"⚠️ Could not build voice_url: {e}")
+def _sse(payload, event=None):
+    """Format one Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-        return jsonify({
-            "reply": bot_text,
-            "voice_url": voice_url,
-            "language": language,
-            "session_id": session_id,
-            "conversation_length": len(conversation_sessions[session_id]),
-            "safety_checked": True
-        })
 
+# Streaming variant of /chatbot over Server-Sent Events. Same request body;
+# emits "delta" messages with partial text as Gemini produces it, then one
+# "done" event carrying the same payload /chatbot returns (voice_url etc.).
+@chatbot_bp.route("/chatbot/stream", methods=["POST"])
+def chatbot_stream():
+    try:
+        chat, early_response = _prepare_chat_request()
     except Exception as e:
-        error_msg = str(e)
-        print(f"Chatbot error: {error_msg}")
-        
-        # Always return a helpful response, even on error
-        fallback_response = "I'm having trouble processing that right now, but I'm here to help! Please ask me about dairy farm management, milk production, animal care, or farm business operations. I'll do my best to assist you!"
-        
-        # Provide more specific error messages
-        if "api_key" in error_msg.lower() or "authentication" in error_msg.lower():
-            return jsonify({
-                "error": "API configuration issue",
-                "reply": fallback_response
-            }), 200  # Return 200 so frontend gets the fallback message
-        elif "quota" in error_msg.lower() or "limit" in error_msg.lower():
-            return jsonify({
-                "error": "Service temporarily unavailable",
-                "reply": "I've reached my temporary limit. Please try again in a moment, and I'll be happy to help with your dairy management questions!"
-            }), 200
-        else:
-            return jsonify({
-                "error": "Processing error",
-                "reply": fallback_response
-            }), 200
+        payload, status = _error_reply(e)
+        return jsonify(payload), status
+    if early_response:
+        return early_response
+
+    def generate():
+        parts = []
+        try:
+            yield _sse({"session_id": chat["session_id"], "language": chat["language"]}, event="start")
+            if chat["cached_reply"]:
+                yield _sse({"delta": chat["cached_reply"]})
+                yield _sse(_finish_reply(chat, chat["cached_reply"]), event="done")
+                return
+
+            model = gemini_client.get_model()
+            try:
+                response = model.generate_content(
+                    chat["contents"],
+                    generation_config=GENERATION_CONFIG,
+                    safety_settings=SAFETY_SETTINGS,
+                    stream=True
+                )
+                for chunk in response:
+                    try:
+                        text = chunk.text
+                    except Exception:
+                        # Blocked / empty candidates raise on .text
+                        continue
+                    if text:
+                        parts.append(text)
+                        yield _sse({"delta": text})
+                bot_text = "".join(parts)
+                if bot_text.strip():
+                    _cache_reply(chat, bot_text)
+                else:
+                    bot_text, _ = _reply_from_response(response)
+                    yield _sse({"delta": bot_text})
+            except Exception as gen_error:
+                bot_text = _reply_for_error(gen_error)
+                if not parts:
+                    yield _sse({"delta": bot_text})
+                else:
+                    bot_text = "".join(parts)
+            yield _sse(_finish_reply(chat, bot_text), event="done")
+        except Exception as e:
+            payload, _ = _error_reply(e)
+            yield _sse(payload, event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-# Route to serve voice files
+# Route to serve voice files. For a voice_job_id: 202 while synthesis is
+# running (?wait=N blocks up to N seconds), then the audio itself.
 @chatbot_bp.route("/voice/<filename>", methods=["GET"])
 def get_voice(filename):
     try:
-        voice_path = os.path.join(STATIC_DIR, filename)
+        if voice_jobs.is_job_id(filename):
+            wait = min(max(request.args.get("wait", 0, type=float), 0), 15)
+            state = voice_jobs.wait(filename, wait) if wait else voice_jobs.status(filename)
+            if state == "ready":
+                voice_jobs.touch(filename)
+                return send_file(voice_jobs.audio_path(filename), mimetype="audio/mpeg")
+            if state == "pending":
+                return jsonify({"status": "pending", "voice_job_id": filename}), 202
+            return jsonify({"status": state, "error": "Voice generation failed"}), 404
+
+        voice_path = os.path.join(STATIC_DIR, os.path.basename(filename))
         if os.path.exists(voice_path):
             return send_file(voice_path, mimetype="audio/mpeg")
         else:
@@ -408,10 +490,49 @@ def get_voice(filename):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Semantic answer cache hit rate
+@chatbot_bp.route("/answer-cache/stats", methods=["GET"])
+def answer_cache_stats():
+    return jsonify(reply_cache.stats())
+
+# Voice cache hit rate and disk usage
+@chatbot_bp.route("/voice-cache/stats", methods=["GET"])
+def voice_cache_stats():
+    return jsonify(voice_jobs.stats())
+
+# RAG backend, index size, last build and query-embedding cache counters
+@chatbot_bp.route("/rag/stats", methods=["GET"])
+def rag_stats():
+    if not rag_module:
+        return jsonify({"available": False})
+    return jsonify({
+        "available": rag_module.index.ready,
+        "backend": rag_module.index.backend,
+        "passages": len(rag_module.index.docs),
+        "ann": ({"lists": rag_module.index.ann.n_lists, "dtype": rag_module.index.ann.dtype,
+                 "probes": rag_module.index.ann_probes} if rag_module.index.ann is not None else None),
+        "last_build": rag_module.index.last_build,
+        "query_cache": rag_module.index.query_cache.stats()
+    })
+
+
+# Transcript cache hit rate
+@chatbot_bp.route("/speech/stats", methods=["GET"])
+def speech_stats():
+    return jsonify(speech.transcripts.stats())
+
+
+# Session store size/eviction counters
+@chatbot_bp.route("/sessions/stats", methods=["GET"])
+def session_stats():
+    return jsonify(session_store.stats())
+
 # Test endpoint to verify API key and list available models
 @chatbot_bp.route("/test", methods=["GET"])
 def test():
+    GEMINI_API_KEY = gemini_client.api_key()
     try:
+        gemini_client.ensure_configured()
         models = genai.list_models()
         all_models = [{"name": m.name, "methods": list(m.supported_generation_methods)} for m in models]
         available_for_generate = [m["name"] for m in all_models if 'generateContent' in m["methods"]]
@@ -421,7 +542,7 @@ def test():
             "api_key_loaded": bool(GEMINI_API_KEY),
             "api_key_length": len(GEMINI_API_KEY) if GEMINI_API_KEY else 0,
             "service": "Google Gemini",
-            "current_model": MODEL_NAME,
+            "current_model": gemini_client.model_name(force_refresh=True),
             "available_models": available_for_generate,
             "all_models": all_models
         })
@@ -431,7 +552,7 @@ def test():
             "api_key_loaded": bool(GEMINI_API_KEY),
             "api_key_length": len(GEMINI_API_KEY) if GEMINI_API_KEY else 0,
             "service": "Google Gemini",
-            "current_model": MODEL_NAME,
+            "current_model": gemini_client.current_model_name(),
             "error": str(e)
         })
 
@@ -439,6 +560,7 @@ def test():
 @chatbot_bp.route("/models", methods=["GET"])
 def list_models():
     try:
+        gemini_client.ensure_configured()
         models = genai.list_models()
         result = []
         for m in models:
@@ -451,26 +573,60 @@ def list_models():
         return jsonify({
             "status": "OK",
             "models": result,
-            "current_model": MODEL_NAME
+            "current_model": gemini_client.model_name()
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# Speech-to-Text endpoint using Gemini
+def _ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+# Speech-to-Text endpoint using Gemini. Takes {"audio": base64} JSON,
+# multipart/form-data with an "audio" file part, or a raw audio/* body
+# (?language=kn). "timings" reports milliseconds per stage.
 @chatbot_bp.route("/speech-to-text", methods=["POST"])
 def speech_to_text():
+    data = None
+    started = time.perf_counter()
+    timings = {}
     try:
-        data = request.get_json()
-        audio_base64 = data.get("audio")
+        try:
+            data = uploads.read_request(request, "audio", "audio/")
+        except uploads.UploadTooLarge as e:
+            return jsonify({"error": str(e), "text": ""}), 413
+        audio = data.get("audio")
         language = data.get("language", "en")
         
-        if not audio_base64:
+        if not audio:
             return jsonify({"error": "No audio provided"}), 400
         
         print(f"🎤 Received audio for transcription, language: {language}")
         
-        # Decode base64 audio
-        audio_bytes = base64.b64decode(audio_base64)
+        # Decode base64 audio (uploads are already a file object), hash it and
+        # answer retries of the same recording from the transcript cache
+        stage = time.perf_counter()
+        audio_stream = uploads.media_stream(audio)
+        audio_bytes, audio_size, audio_hash = speech.read_clip(audio_stream)
+        timings["read_ms"] = _ms(stage)
+        cache_key = speech.cache_key(audio_hash, language)
+        cached_text = speech.transcripts.get(cache_key)
+        if cached_text is not None:
+            timings["total_ms"] = _ms(started)
+            print(f"⚡ Transcript cache hit ({audio_size} bytes)")
+            return jsonify({
+                "text": cached_text,
+                "language": language,
+                "cached": True,
+                "timings": timings
+            })
+
+        if audio_bytes is not None:
+            head = audio_bytes[:16]
+        else:
+            head = audio_stream.read(16)
+            audio_stream.seek(0)
+        mime_type = speech.sniff_mime_type(head, data.get("audio_mime_type"))
         
         # Map language codes to full names for better transcription
         lang_map = {
@@ -485,28 +641,43 @@ def speech_to_text():
         
         # Use Gemini to transcribe audio
         # Note: Gemini supports audio input for transcription
-        model = genai.GenerativeModel(MODEL_NAME)
+        stage = time.perf_counter()
+        model = gemini_client.get_model()
+        timings["model_ms"] = _ms(stage)
         
         prompt = f"""Transcribe this audio to text. The speaker is speaking in {lang_name}. 
         Output only the transcribed text without any additional commentary or explanation.
         If the audio is in {lang_name}, provide transcription in {lang_name} script."""
         
-        # Upload audio file for Gemini
-        audio_file = genai.upload_file(
-            path=io.BytesIO(audio_bytes),
-            mime_type="audio/mpeg"
-        )
+        # Short clips go inline with the prompt; only long ones need the File API
+        if audio_bytes is not None:
+            audio_part = {"mime_type": mime_type, "data": audio_bytes}
+        else:
+            stage = time.perf_counter()
+            audio_part = genai.upload_file(path=audio_stream, mime_type=mime_type)
+            timings["upload_ms"] = _ms(stage)
         
-        response = model.generate_content([prompt, audio_file])
+        stage = time.perf_counter()
+        response = model.generate_content([prompt, audio_part])
         transcribed_text = response.text.strip()
+        timings["transcribe_ms"] = _ms(stage)
+        if transcribed_text:
+            speech.transcripts.set(cache_key, transcribed_text)
+        timings["total_ms"] = _ms(started)
         
-        print(f"✅ Transcribed: {transcribed_text}")
+        print(f"✅ Transcribed ({mime_type}, {audio_size} bytes, {'inline' if audio_bytes is not None else 'upload'}, "
+              f"{timings['total_ms']} ms): {transcribed_text}")
         
         return jsonify({
             "text": transcribed_text,
-            "language": language
+            "language": language,
+            "mime_type": mime_type,
+            "cached": False,
+            "timings": timings
         })
         
     except Exception as e:
         print(f"❌ Speech-to-text error: {e}")
         return jsonify({"error": str(e), "text": ""}), 500
+    finally:
+        uploads.close(data, "audio")
@@ -1,9 +1,182 @@
-from flask import Blueprint, request, jsonify
-from models import db, Customer, MilkCollection, Payment
+from flask import Blueprint, request, jsonify, Response, current_app, stream_with_context
+from models import db, Customer, CustomerBalance, MilkCollection, Payment
 from routes.auth_routes import token_required
+import ledger
+from sqlalchemy import and_, or_, insert
+import base64
+import binascii
+import datetime
 
 data_bp = Blueprint("data_bp", __name__)
 
+# Listing limits for keyset pagination / streaming
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
+MAX_BATCH_ENTRIES = 1000
+
+
+# ---------------- LISTING HELPERS ---------------- #
+
+def _encode_cursor(row):
+    """Opaque cursor for the (date, id) position of the last row on a page"""
+    date_part = row.date.isoformat() if row.date else ""
+    raw = f"{date_part}|{row.id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    date_part, id_part = raw.split("|", 1)
+    date = datetime.date.fromisoformat(date_part) if date_part else None
+    return date, int(id_part)
+
+
+def _parse_listing_args():
+    """
+    Read ?limit=&cursor=&stream= from the query string.
+    Returns (limit, cursor, stream); limit is None when not paginating, and
+    DEFAULT_PAGE_LIMIT when a cursor comes without one.
+    Raises ValueError on malformed input.
+    """
+    limit = request.args.get("limit")
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = min(limit, MAX_PAGE_LIMIT)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        cursor = _decode_cursor(cursor)
+        if limit is None:
+            limit = DEFAULT_PAGE_LIMIT
+    else:
+        cursor = None
+
+    stream = request.args.get("stream", "").lower() in ("1", "true", "yes")
+    return limit, cursor, stream
+
+
+PAYMENT_MODES = ("cash", "upi", "bank")
+
+
+def _apply_filters(query, model):
+    """
+    Push ?from=&to=&customer_id= (and ?payment_mode= for payments) into the
+    WHERE clause so they hit the (customer_id, date) index.
+    Raises ValueError on malformed input.
+    """
+    date_from = request.args.get("from")
+    if date_from:
+        query = query.filter(model.date >= datetime.date.fromisoformat(date_from))
+
+    date_to = request.args.get("to")
+    if date_to:
+        query = query.filter(model.date <= datetime.date.fromisoformat(date_to))
+
+    customer_id = request.args.get("customer_id")
+    if customer_id:
+        query = query.filter(model.customer_id == int(customer_id))
+
+    payment_mode = request.args.get("payment_mode")
+    if payment_mode and hasattr(model, "payment_mode"):
+        if payment_mode not in PAYMENT_MODES:
+            raise ValueError("payment_mode must be one of cash, upi, bank")
+        query = query.filter(model.payment_mode == payment_mode)
+
+    return query
+
+
+def _keyset(query, model, cursor):
+    """Order newest first on (date, id) and seek past the cursor position"""
+    if cursor:
+        date, last_id = cursor
+        if date is None:
+            # Undated rows sort last; only the id decides the position among them
+            query = query.filter(model.date.is_(None), model.id < last_id)
+        else:
+            query = query.filter(or_(
+                model.date < date,
+                and_(model.date == date, model.id < last_id),
+                model.date.is_(None)
+            ))
+    # NULL dates already sort last under DESC on both MySQL and SQLite
+    return query.order_by(model.date.desc(), model.id.desc())
+
+
+def _list_response(query, model, serialize):
+    """
+    Shared GET handler for milk/payment listings.
+      - no params:        plain JSON array (legacy behaviour)
+      - ?limit=N[&cursor] {"items": [...], "next_cursor": "..."} page
+      - ?stream=1         JSON array streamed row by row from the DB cursor
+    Filters (?from=&to=&customer_id=&payment_mode=) apply in every mode.
+    """
+    try:
+        query = _apply_filters(query, model)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {str(e)}"}), 400
+
+    try:
+        limit, cursor, stream = _parse_listing_args()
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    query = _keyset(query, model, cursor)
+
+    if stream:
+        if limit:
+            query = query.limit(limit)
+        dumps = current_app.json.dumps
+
+        def generate():
+            yield "["
+            first = True
+            for row in query.yield_per(STREAM_BATCH_SIZE):
+                if not first:
+                    yield ","
+                first = False
+                yield dumps(serialize(row))
+            yield "]"
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
+    if limit is None:
+        return jsonify([serialize(r) for r in query.all()])
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "items": [serialize(r) for r in rows],
+        "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+        "limit": limit
+    })
+
+
+def _milk_to_dict(r):
+    return {
+        "id": r.id,
+        "customer_id": r.customer_id,
+        "date": r.date,
+        "quantity": r.quantity,
+        "fat": r.fat,
+        "price_per_litre": r.price_per_litre,
+        "total_price": r.total_price
+    }
+
+
+def _payment_to_dict(p):
+    return {
+        "id": p.id,
+        "customer_id": p.customer_id,
+        "amount_paid": p.amount_paid,
+        "date": p.date,
+        "payment_mode": p.payment_mode
+    }
+
 # ---------------- CUSTOMER ROUTES ---------------- #
 
 @data_bp.route("/customers", methods=["POST"])
@@ -60,6 +233,69 @@ def delete_customer(current_user, id):
     return jsonify({"message": "Customer deleted successfully"})
 
 
+# ---------------- BALANCE ROUTES ---------------- #
+
+def _balance_to_dict(customer, b):
+    return {
+        "customer_id": customer.id,
+        "name": customer.name,
+        "milk_quantity": b.milk_quantity,
+        "milk_amount": b.milk_amount,
+        "amount_paid": b.amount_paid,
+        "balance": b.milk_amount - b.amount_paid,
+        "milk_entries": b.milk_entries,
+        "payment_entries": b.payment_entries,
+        "updated_at": b.updated_at.isoformat() if b.updated_at else None
+    }
+
+
+@data_bp.route("/customers/<int:id>/balance", methods=["GET"])
+@token_required
+def get_customer_balance(current_user, id):
+    customer = Customer.query.filter_by(id=id, user_id=current_user.id).first()
+    if not customer:
+        return jsonify({"error": "Customer not found"}), 404
+
+    balance = customer.balance
+    if balance is None:
+        balance = ledger.backfill_balances([customer.id])[customer.id]
+
+    return jsonify(_balance_to_dict(customer, balance))
+
+
+@data_bp.route("/customers/<int:id>/balance/refresh", methods=["POST"])
+@token_required
+def refresh_customer_balance(current_user, id):
+    """Recompute the summary row from the milk/payment tables (repairs any drift)"""
+    customer = Customer.query.filter_by(id=id, user_id=current_user.id).first()
+    if not customer:
+        return jsonify({"error": "Customer not found"}), 404
+
+    balance = ledger.backfill_balances([customer.id])[customer.id]
+    return jsonify(_balance_to_dict(customer, balance))
+
+
+@data_bp.route("/customers/balances", methods=["GET"])
+@token_required
+def get_customer_balances(current_user):
+    rows = (
+        db.session.query(Customer, CustomerBalance)
+        .outerjoin(CustomerBalance, CustomerBalance.customer_id == Customer.id)
+        .filter(Customer.user_id == current_user.id)
+        .order_by(Customer.id)
+        .all()
+    )
+
+    # Customers without a summary row yet are backfilled in one grouped pass
+    missing = [c.id for c, b in rows if b is None]
+    built = {}
+    if missing:
+        built = ledger.backfill_balances(missing)
+
+    result = [_balance_to_dict(c, b if b is not None else built[c.id]) for c, b in rows]
+    return jsonify(result)
+
+
 # ---------------- MILK COLLECTION ROUTES ---------------- #
 
 @data_bp.route("/milk", methods=["POST"])
@@ -75,32 +311,126 @@ def add_milk_record(current_user):
         total_price=data.get("total_price")
     )
     db.session.add(new_record)
+    ledger.record_milk(new_record.customer_id, new_record.quantity, new_record.total_price, entries=1)
     db.session.commit()
     return jsonify({"message": "Milk record added successfully"}), 201
 
 
+def _parse_milk_entry(entry, owned_ids):
+    """Validate one batch entry; returns (row dict, None) or (None, error message)"""
+    if not isinstance(entry, dict):
+        return None, "Entry must be an object"
+
+    try:
+        customer_id = int(entry.get("customer_id"))
+    except (TypeError, ValueError):
+        return None, "customer_id is required"
+    if customer_id not in owned_ids:
+        return None, "Customer not found"
+
+    try:
+        date = datetime.date.fromisoformat(str(entry.get("date")))
+    except ValueError:
+        return None, "date must be YYYY-MM-DD"
+
+    row = {"customer_id": customer_id, "date": date}
+    for field in ("quantity", "fat", "price_per_litre", "total_price"):
+        value = entry.get(field)
+        if value is None:
+            if field == "quantity":
+                return None, "quantity is required"
+            row[field] = None
+            continue
+        try:
+            row[field] = float(value)
+        except (TypeError, ValueError):
+            return None, f"{field} must be a number"
+    return row, None
+
+
+@data_bp.route("/milk/batch", methods=["POST"])
+@token_required
+def add_milk_records_batch(current_user):
+    """
+    POST /milk/batch  {"entries": [{customer_id, date, quantity, ...}, ...], "atomic": false}
+    Ownership of every customer is checked with one query and all valid rows
+    go in with a single multi-row INSERT in one transaction. With "atomic": true
+    nothing is written if any entry is invalid; the valid ones are then
+    reported as "skipped".
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        entries, atomic = data, False
+    elif isinstance(data, dict):
+        entries, atomic = data.get("entries"), bool(data.get("atomic", False))
+    else:
+        entries, atomic = None, False
+
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "entries must be a non-empty list"}), 400
+    if len(entries) > MAX_BATCH_ENTRIES:
+        return jsonify({"error": f"At most {MAX_BATCH_ENTRIES} entries per batch"}), 400
+
+    requested_ids = set()
+    for entry in entries:
+        try:
+            requested_ids.add(int(entry.get("customer_id")))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    owned_ids = {
+        cid for (cid,) in db.session.query(Customer.id).filter(
+            Customer.user_id == current_user.id,
+            Customer.id.in_(requested_ids)
+        )
+    } if requested_ids else set()
+
+    rows, results = [], []
+    for i, entry in enumerate(entries):
+        row, error = _parse_milk_entry(entry, owned_ids)
+        if error:
+            results.append({"index": i, "status": "error", "error": error})
+        else:
+            rows.append(row)
+            results.append({"index": i, "status": "created"})
+
+    failed = len(entries) - len(rows)
+    if not rows or (atomic and failed):
+        for result in results:
+            if result["status"] == "created":
+                result["status"] = "skipped"
+        return jsonify({"created": 0, "failed": failed, "results": results}), 400
+
+    totals = {}
+    for row in rows:
+        qty, amount, count = totals.get(row["customer_id"], (0.0, 0.0, 0))
+        totals[row["customer_id"]] = (
+            qty + ledger.as_float(row["quantity"]),
+            amount + ledger.as_float(row["total_price"]),
+            count + 1
+        )
+
+    try:
+        db.session.execute(insert(MilkCollection).values(rows))
+        ledger.record_milk_batch(totals)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Details stay in the server log; the DB error text isn't for clients
+        print(f"❌ Milk batch insert failed: {type(e).__name__}: {str(e)}")
+        return jsonify({"error": "Batch insert failed"}), 500
+
+    return jsonify({"created": len(rows), "failed": failed, "results": results}), 201
+
+
 @data_bp.route("/milk", methods=["GET"])
 @token_required
 def get_milk_records(current_user):
-    records = (
+    query = (
         db.session.query(MilkCollection)
         .join(Customer)
         .filter(Customer.user_id == current_user.id)
-        .all()
     )
-    result = [
-        {
-            "id": r.id,
-            "customer_id": r.customer_id,
-            "date": r.date,
-            "quantity": r.quantity,
-            "fat": r.fat,
-            "price_per_litre": r.price_per_litre,
-            "total_price": r.total_price
-        }
-        for r in records
-    ]
-    return jsonify(result)
+    return _list_response(query, MilkCollection, _milk_to_dict)
 
 
 @data_bp.route("/milk/<int:id>", methods=["PUT"])
@@ -113,6 +443,7 @@ def update_milk_record(current_user, id):
     if not record:
         return jsonify({"error": "Milk record not found"}), 404
 
+    old_quantity, old_total = ledger.as_float(record.quantity), ledger.as_float(record.total_price)
     data = request.get_json()
     record.quantity = data.get("quantity", record.quantity)
     record.fat = data.get("fat", record.fat)
@@ -120,6 +451,11 @@ def update_milk_record(current_user, id):
     record.total_price = data.get("total_price", record.total_price)
     record.date = data.get("date", record.date)
 
+    ledger.record_milk(
+        record.customer_id,
+        ledger.as_float(record.quantity) - old_quantity,
+        ledger.as_float(record.total_price) - old_total
+    )
     db.session.commit()
     return jsonify({"message": "Milk record updated successfully"})
 
@@ -135,6 +471,12 @@ def delete_milk_record(current_user, id):
         return jsonify({"error": "Milk record not found"}), 404
 
     db.session.delete(record)
+    ledger.record_milk(
+        record.customer_id,
+        -ledger.as_float(record.quantity),
+        -ledger.as_float(record.total_price),
+        entries=-1
+    )
     db.session.commit()
     return jsonify({"message": "Milk record deleted successfully"})
 
@@ -152,6 +494,7 @@ def add_payment(current_user):
         payment_mode=data.get("payment_mode")
     )
     db.session.add(new_payment)
+    ledger.record_payment(new_payment.customer_id, new_payment.amount_paid, entries=1)
     db.session.commit()
     return jsonify({"message": "Payment added successfully"}), 201
 
@@ -159,23 +502,12 @@ def add_payment(current_user):
 @data_bp.route("/payments", methods=["GET"])
 @token_required
 def get_payments(current_user):
-    payments = (
+    query = (
         db.session.query(Payment)
         .join(Customer)
         .filter(Customer.user_id == current_user.id)
-        .all()
     )
-    result = [
-        {
-            "id": p.id,
-            "customer_id": p.customer_id,
-            "amount_paid": p.amount_paid,
-            "date": p.date,
-            "payment_mode": p.payment_mode
-        }
-        for p in payments
-    ]
-    return jsonify(result)
+    return _list_response(query, Payment, _payment_to_dict)
 
 
 @data_bp.route("/payments/<int:id>", methods=["PUT"])
@@ -188,11 +520,13 @@ def update_payment(current_user, id):
     if not payment:
         return jsonify({"error": "Payment not found"}), 404
 
+    old_amount = ledger.as_float(payment.amount_paid)
     data = request.get_json()
     payment.amount_paid = data.get("amount_paid", payment.amount_paid)
     payment.date = data.get("date", payment.date)
     payment.payment_mode = data.get("payment_mode", payment.payment_mode)
 
+    ledger.record_payment(payment.customer_id, ledger.as_float(payment.amount_paid) - old_amount)
     db.session.commit()
     return jsonify({"message": "Payment updated successfully"})
 
@@ -208,5 +542,6 @@ def delete_payment(current_user, id):
         return jsonify({"error": "Payment not found"}), 404
 
     db.session.delete(payment)
+    ledger.record_payment(payment.customer_id, -ledger.as_float(payment.amount_paid), entries=-1)
     db.session.commit()
     return jsonify({"message": "Payment deleted successfully"})
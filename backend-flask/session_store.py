@@ -0,0 +1,215 @@
+"""
+Conversation history storage for the chatbot.
+
+Two interchangeable backends with the same interface:
+  - MemorySessionStore: per-process LRU with TTL, session count and byte caps
+  - SQLiteSessionStore: one SQLite file shared by every gunicorn worker, with
+    the same TTL, session count and byte caps applied every EVICT_EVERY writes
+
+Pick one with CHAT_SESSION_BACKEND=memory|sqlite (default sqlite; falls back
+to memory if the database file can't be opened).
+"""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(__file__)
+
+MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "20"))       # per session (10 exchanges)
+SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(6 * 60 * 60)))      # idle seconds before eviction
+MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX", "5000"))
+MAX_BYTES = int(os.getenv("CHAT_SESSION_MAX_BYTES", str(32 * 1024 * 1024)))
+EVICT_EVERY = 100                                                       # SQLite: writes per worker between evictions
+
+
+def _size(messages):
+    return sum(len(m.get("content", "").encode("utf-8")) + 16 for m in messages)
+
+
+class MemorySessionStore:
+    """In-process store; evicts least recently used sessions past any limit"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL,
+                 max_bytes=MAX_BYTES, max_messages=MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()   # session_id -> (messages, last_used, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _drop(self, session_id):
+        _, _, size = self._sessions.pop(session_id)
+        self._bytes -= size
+        self.evictions += 1
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            oldest_id, (_, last_used, _) = next(iter(self._sessions.items()))
+            if (last_used < cutoff or len(self._sessions) > self.max_sessions
+                    or self._bytes > self.max_bytes):
+                self._drop(oldest_id)
+            else:
+                break
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return []
+            messages, last_used, _ = item
+            if last_used < time.monotonic() - self.ttl:
+                self._drop(session_id)
+                return []
+            return list(messages)
+
+    def append(self, session_id, new_messages):
+        """Append messages, trim to max_messages; returns the new history length"""
+        with self._lock:
+            item = self._sessions.pop(session_id, None)
+            messages = list(item[0]) if item else []
+            if item:
+                self._bytes -= item[2]
+            messages.extend(new_messages)
+            messages = messages[-self.max_messages:]
+            size = _size(messages)
+            self._sessions[session_id] = (messages, time.monotonic(), size)
+            self._bytes += size
+            self._evict()
+            return len(messages)
+
+    def clear(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._bytes -= self._sessions.pop(session_id)[2]
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        }
+
+
+class SQLiteSessionStore:
+    """Store shared across worker processes through one SQLite file (WAL mode)"""
+
+    def __init__(self, path, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL,
+                 max_bytes=MAX_BYTES, max_messages=MAX_MESSAGES):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._local = threading.local()
+        self._writes = itertools.count(1)   # next() is atomic, unlike += across threads
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            "session_id TEXT PRIMARY KEY, "
+            "history TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_chat_sessions_updated ON chat_sessions (updated_at)")
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread, and never reuse one across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT history, updated_at FROM chat_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if not row or row[1] < time.time() - self.ttl:
+            return []
+        return json.loads(row[0])
+
+    def append(self, session_id, new_messages):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so concurrent workers can't lose updates
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT history, updated_at FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            now = time.time()
+            messages = json.loads(row[0]) if row and row[1] >= now - self.ttl else []
+            messages.extend(new_messages)
+            messages = messages[-self.max_messages:]
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (session_id, history, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(messages, ensure_ascii=False), now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if next(self._writes) % EVICT_EVERY == 0:
+            self._evict()
+        return len(messages)
+
+    def _evict(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        conn.execute(
+            "DELETE FROM chat_sessions WHERE session_id IN ("
+            "SELECT session_id FROM chat_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+        # Byte cap: drop the least recently used sessions past max_bytes of history
+        conn.execute(
+            "DELETE FROM chat_sessions WHERE session_id IN ("
+            "SELECT session_id FROM ("
+            "SELECT session_id, SUM(LENGTH(CAST(history AS BLOB))) "
+            "OVER (ORDER BY updated_at DESC ROWS UNBOUNDED PRECEDING) AS total "
+            "FROM chat_sessions) WHERE total > ?)",
+            (self.max_bytes,)
+        )
+
+    def clear(self, session_id):
+        self._conn().execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self):
+        count, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(history AS BLOB))), 0) FROM chat_sessions"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": count,
+            "bytes": size,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        }
+
+
+def create_session_store():
+    backend = os.getenv("CHAT_SESSION_BACKEND", "sqlite").lower()
+    if backend == "sqlite":
+        path = os.getenv("CHAT_SESSION_DB", os.path.join(BASE_DIR, "chat_sessions.db"))
+        try:
+            return SQLiteSessionStore(path)
+        except Exception as e:
+            print(f"⚠️ SQLite session store unavailable ({e}), using in-memory sessions")
+    return MemorySessionStore()
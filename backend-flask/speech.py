@@ -0,0 +1,70 @@
+"""
+Helpers for /chat/speech-to-text.
+
+Clips up to SPEECH_INLINE_MAX_BYTES are sent to Gemini inline with the
+prompt instead of through genai.upload_file (one round trip instead of
+two). The audio format is sniffed from the bytes, since browsers and phones
+label webm/ogg/m4a recordings inconsistently. Transcripts are cached by
+(sha256 of the audio, language) so a client retrying the same recording
+gets the stored text without another Gemini call.
+"""
+import hashlib
+import io
+import os
+
+from cache import TTLCache
+
+SPEECH_INLINE_MAX_BYTES = int(os.getenv("SPEECH_INLINE_MAX_BYTES", str(8 * 1024 * 1024)))
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "256"))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", str(60 * 60)))
+DEFAULT_MIME_TYPE = "audio/mpeg"
+
+transcripts = TTLCache(maxsize=TRANSCRIPT_CACHE_SIZE, ttl=TRANSCRIPT_CACHE_TTL)
+
+
+def sniff_mime_type(head, declared=None):
+    """Audio MIME type from the first bytes of a clip; the declared type if unrecognised"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[:4] == b"OggS":
+        return "audio/ogg"
+    if head[:4] == b"fLaC":
+        return "audio/flac"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "audio/webm"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return "audio/aiff"
+    if head[:5] == b"#!AMR":
+        return "audio/amr"
+    if head[4:8] == b"ftyp":
+        return "audio/3gpp" if head[8:11] == b"3gp" else "audio/mp4"
+    if head[:3] == b"ID3":
+        return "audio/mpeg"
+    if len(head) > 1 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return "audio/aac"      # ADTS
+        if head[1] & 0xE0 == 0xE0:
+            return "audio/mpeg"     # MPEG frame sync
+    if declared and declared.startswith("audio/") and declared != "audio/*":
+        return declared
+    return DEFAULT_MIME_TYPE
+
+
+def read_clip(stream):
+    """(bytes or None, size, sha256 hex) - bytes only for clips small enough to send inline"""
+    digest = hashlib.sha256()
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= SPEECH_INLINE_MAX_BYTES:
+        data = stream.read()
+        digest.update(data)
+        return data, size, digest.hexdigest()
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return None, size, digest.hexdigest()
+
+
+def cache_key(audio_hash, language):
+    return f"{language}:{audio_hash}"
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, UserTokenVersion
+
+# Token revocation for claims-based auth. Every login embeds the user's current
+# version in the JWT ("ver"); bumping the version revokes older tokens. Each
+# worker keeps {user_id: version} in memory and re-reads the (tiny)
+# user_token_versions table at most every TOKEN_VERSION_REFRESH seconds; the
+# auth user cache keys its snapshots on the same map.
+REFRESH_SECONDS = int(os.getenv("TOKEN_VERSION_REFRESH", "5"))
+
+_versions = {}
+_loaded_at = None
+_lock = threading.Lock()
+
+
+def _refresh():
+    global _versions, _loaded_at
+    now = time.monotonic()
+    if _loaded_at is not None and now - _loaded_at < REFRESH_SECONDS:
+        return
+    with _lock:
+        if _loaded_at is not None and now - _loaded_at < REFRESH_SECONDS:
+            return
+        rows = db.session.query(UserTokenVersion.user_id, UserTokenVersion.version).all()
+        _versions = {user_id: version for user_id, version in rows}
+        _loaded_at = now
+
+
+def is_current(user_id, token_version):
+    """
+    True unless the token was issued before the user's latest bump.
+    A stale in-memory map can only let a revoked token through for up to
+    REFRESH_SECONDS; it never rejects a freshly issued one.
+    """
+    return token_version >= current(user_id)
+
+
+def current(user_id):
+    """This worker's view of the user's version, at most REFRESH_SECONDS stale"""
+    _refresh()
+    return _versions.get(user_id, 0)
+
+
+def version_for_login(user_id):
+    """Authoritative version from the DB, used when issuing a new token"""
+    row = db.session.get(UserTokenVersion, user_id)
+    return row.version if row else 0
+
+
+def _increment(user_id):
+    return UserTokenVersion.query.filter_by(user_id=user_id).update(
+        {UserTokenVersion.version: UserTokenVersion.version + 1,
+         UserTokenVersion.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+
+
+def bump(user_id):
+    """
+    Revoke all existing tokens for user_id. Runs in the caller's transaction:
+    call it before committing the user change, so both are saved or neither
+    is, then reload(user_id) after the commit.
+    """
+    if _increment(user_id):
+        return
+    try:
+        # First bump for this user: a concurrent first bump may insert the
+        # row too, in which case the loser increments the winner's row
+        with db.session.begin_nested():
+            db.session.add(UserTokenVersion(user_id=user_id, version=1))
+    except IntegrityError:
+        _increment(user_id)
+
+
+def reload(user_id):
+    """Re-read one user's version after a commit, so this worker applies it at once"""
+    version = version_for_login(user_id)
+    with _lock:
+        _versions[user_id] = version
+    return version
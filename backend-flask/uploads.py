@@ -0,0 +1,111 @@
+"""
+Media uploads for the chat routes without base64-in-JSON.
+
+/chat/chatbot and /chat/speech-to-text accept, besides the original JSON body:
+  multipart/form-data   text fields as in the JSON body, the media as a file
+                        part ("image" / "audio")
+  raw body              Content-Type image/* or audio/*, the other fields in
+                        the query string (?session_id=...&language=kn)
+
+Uploads are never held as one big string: Werkzeug spools multipart files
+over 500 KB to a temp file, and raw bodies are copied in chunks into a
+SpooledTemporaryFile (in memory up to UPLOAD_SPOOL_BYTES, then on disk).
+The media value handed to the routes is that file object; a base64 string
+from the JSON body still works everywhere.
+"""
+import base64
+import io
+import os
+import tempfile
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(16 * 1024 * 1024)))    # media, decoded
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+CHUNK_BYTES = 64 * 1024
+FIELDS_OVERHEAD_BYTES = 64 * 1024    # text fields, multipart boundaries, data URL prefix
+# Largest acceptable request body: the same media base64-encoded in JSON (4/3 bigger)
+MAX_REQUEST_BYTES = 4 * -(-UPLOAD_MAX_BYTES // 3) + FIELDS_OVERHEAD_BYTES
+BOOL_FIELDS = ("force_language",)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _too_large():
+    return UploadTooLarge(f"Upload larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+
+
+def spool(stream, limit=UPLOAD_MAX_BYTES):
+    """Copy a binary stream into a rewound SpooledTemporaryFile, at most `limit` bytes"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            spooled.close()
+            raise _too_large()
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def _fields(values):
+    data = values.to_dict()
+    for name in BOOL_FIELDS:
+        if name in data:
+            data[name] = data[name].strip().lower() in ("1", "true", "yes", "on")
+    return data
+
+
+def read_request(req, media_field, media_prefix):
+    """
+    The request as the dict the JSON body would give, with `media_field`
+    holding a file object for multipart / raw uploads. Raises
+    UploadTooLarge when the media is over UPLOAD_MAX_BYTES; a JSON body may
+    be up to MAX_REQUEST_BYTES, the base64 size of that.
+    """
+    if req.mimetype == "multipart/form-data":
+        if req.content_length and req.content_length > UPLOAD_MAX_BYTES + FIELDS_OVERHEAD_BYTES:
+            raise _too_large()
+        data = _fields(req.form)
+        upload = req.files.get(media_field)
+        if upload:
+            upload.stream.seek(0, io.SEEK_END)
+            too_large = upload.stream.tell() > UPLOAD_MAX_BYTES
+            upload.stream.seek(0)
+            if too_large:
+                upload.close()
+                raise _too_large()
+            data[media_field] = upload.stream
+            data[f"{media_field}_mime_type"] = upload.mimetype
+        return data
+
+    if req.mimetype.startswith(media_prefix):
+        if req.content_length and req.content_length > UPLOAD_MAX_BYTES:
+            raise _too_large()
+        data = _fields(req.args)
+        data[media_field] = spool(req.stream)
+        data[f"{media_field}_mime_type"] = req.mimetype
+        return data
+
+    if req.content_length and req.content_length > MAX_REQUEST_BYTES:
+        raise _too_large()
+    return req.get_json(force=True, silent=True)
+
+
+def media_stream(value):
+    """Binary file object for a media value: an upload as-is, or a (data URL) base64 string decoded"""
+    if value is None or hasattr(value, "read"):
+        return value
+    if "base64," in value:
+        value = value.split("base64,", 1)[1]
+    return io.BytesIO(base64.b64decode(value))
+
+
+def close(data, media_field):
+    media = data.get(media_field) if isinstance(data, dict) else None
+    if hasattr(media, "close"):
+        media.close()
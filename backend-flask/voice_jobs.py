@@ -0,0 +1,201 @@
+"""
+Background text-to-speech jobs with a content-addressed audio cache.
+
+chatbot_reply() submits the reply text and returns immediately with a job id;
+gTTS runs on a small bounded thread pool. The job id is a hash of
+(text, language), so identical replies (fallback messages, help texts) share
+one mp3 and are only synthesised once. Job state lives on disk next to the
+audio (voice_<id>.mp3 when ready, .pending while running, .failed on error),
+so any gunicorn worker can answer a status poll. Cached audio is evicted
+least-recently-used first once it exceeds TTS_CACHE_MAX_BYTES.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gtts import gTTS
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+os.makedirs(STATIC_DIR, exist_ok=True)
+
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+TTS_MAX_PENDING = int(os.getenv("TTS_MAX_PENDING", "32"))
+TTS_JOB_TIMEOUT = int(os.getenv("TTS_JOB_TIMEOUT", "120"))   # seconds before an unfinished job counts as lost
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "joined": 0, "evictions": 0}
+
+
+def _get_executor():
+    # Created on first use so it is never inherited across a gunicorn fork
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+    return _executor
+
+
+def job_id_for(text, lang):
+    return hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def audio_path(job_id):
+    return os.path.join(STATIC_DIR, f"voice_{job_id}.mp3")
+
+
+def _failed_path(job_id):
+    return os.path.join(STATIC_DIR, f"voice_{job_id}.failed")
+
+
+def _pending_path(job_id):
+    return os.path.join(STATIC_DIR, f"voice_{job_id}.pending")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def touch(job_id):
+    """Mark cached audio as recently used (LRU is by mtime)"""
+    try:
+        os.utime(audio_path(job_id))
+    except OSError:
+        pass
+
+
+def _evict():
+    """Delete least recently used cached audio until under the byte quota"""
+    files = []
+    for path in glob.glob(os.path.join(STATIC_DIR, "voice_*.mp3")):
+        name = os.path.basename(path)[len("voice_"):-len(".mp3")]
+        if not is_job_id(name):
+            continue   # only manage files this cache created
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    if total <= TTS_CACHE_MAX_BYTES:
+        return
+    for _, size, path in sorted(files):
+        _remove(path)
+        total -= size
+        with _lock:
+            _counters["evictions"] += 1
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+
+
+def _synthesise(job_id, text, lang):
+    global _pending
+    path = audio_path(job_id)
+    tmp_path = path + ".part"
+    try:
+        gTTS(text=text, lang=lang, slow=False).save(tmp_path)
+        os.replace(tmp_path, path)   # atomic: pollers never see a half-written file
+        print(f"🔊 Voice job {job_id} ready (Language: {lang})")
+    except Exception as e:
+        print(f"⚠️ TTS error in job {job_id}: {e}")
+        try:
+            with open(_failed_path(job_id), "w", encoding="utf-8") as f:
+                f.write(str(e))
+        except OSError:
+            pass
+        _remove(tmp_path)
+    finally:
+        _remove(_pending_path(job_id))
+        with _lock:
+            _pending -= 1
+    _evict()
+
+
+def _in_flight(job_id):
+    try:
+        return time.time() - os.path.getmtime(_pending_path(job_id)) <= TTS_JOB_TIMEOUT
+    except OSError:
+        return False
+
+
+def submit(text, lang):
+    """
+    Return the job id for (text, lang), queueing synthesis unless the audio is
+    cached or already being generated. None when the queue is full.
+    """
+    global _pending
+    job_id = job_id_for(text, lang)
+    if os.path.exists(audio_path(job_id)):
+        touch(job_id)
+        with _lock:
+            _counters["hits"] += 1
+        return job_id
+    if _in_flight(job_id):
+        with _lock:
+            _counters["joined"] += 1
+        return job_id
+
+    with _lock:
+        if _pending >= TTS_MAX_PENDING:
+            return None
+        _pending += 1
+        _counters["misses"] += 1
+    _remove(_failed_path(job_id))   # allow a retry after an earlier failure
+    with open(_pending_path(job_id), "w"):
+        pass
+    _get_executor().submit(_synthesise, job_id, text, lang)
+    return job_id
+
+
+def is_job_id(value):
+    return len(value) == 32 and all(c in "0123456789abcdef" for c in value)
+
+
+def status(job_id):
+    """'ready', 'pending', 'failed' or 'expired'"""
+    if os.path.exists(audio_path(job_id)):
+        return "ready"
+    if os.path.exists(_failed_path(job_id)):
+        return "failed"
+    if _in_flight(job_id):
+        return "pending"
+    return "expired"
+
+
+def wait(job_id, timeout):
+    """Block up to `timeout` seconds for the job to leave 'pending'"""
+    deadline = time.monotonic() + timeout
+    state = status(job_id)
+    while state == "pending" and time.monotonic() < deadline:
+        time.sleep(0.2)
+        state = status(job_id)
+    return state
+
+
+def stats():
+    """Per-process counters plus current on-disk cache size"""
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["joined"] + counters["misses"]
+    files = [p for p in glob.glob(os.path.join(STATIC_DIR, "voice_*.mp3"))
+             if is_job_id(os.path.basename(p)[len("voice_"):-len(".mp3")])]
+    return {
+        **counters,
+        "hit_rate": round((counters["hits"] + counters["joined"]) / lookups, 4) if lookups else 0.0,
+        "pending": _pending,
+        "workers": TTS_WORKERS,
+        "max_pending": TTS_MAX_PENDING,
+        "files": len(files),
+        "bytes": sum(os.path.getsize(p) for p in files if os.path.exists(p)),
+        "max_bytes": TTS_CACHE_MAX_BYTES
+    }